@@ -5,7 +5,8 @@ import os
 from scipy import stats
 import seaborn as sns
 from functions import plotting_fcts
-import rasterio as rio
+from functions.products import mask_and_scale
+from functions.raster_stack import RasterStack, sample_points
 from pingouin import partial_corr
 
 # Plots Caravan signatures against catchment attributes, e.g. BFI against slope and calculates the fraction of observations in each landform.
@@ -19,11 +20,16 @@ slope_path = data_path + "resampling/" + "Slope_MERIT_30s.tif"
 elevation_path = data_path + "resampling/" + "Elevation_MERIT_30s.tif"
 landform_path = data_path + "resampling/" + "WorldLandform_30sec.tif"
 
-slope = rio.open(slope_path, masked=True)
-elevation = rio.open(elevation_path, masked=True)
-pr = rio.open(pr_path, masked=True)
-pet = rio.open(pet_path, masked=True)
-landform = rio.open(landform_path, masked=True)
+var_list = ["slope_30s", "elevation_30s", "pr_30s", "pet_30s", "landform"]
+path_list = [slope_path, elevation_path, pr_path, pet_path, landform_path]
+stack = RasterStack(path_list, var_list)
+
+# nodata values, offset, and scale of each product (see functions/products.py)
+var_products = {"slope_30s": "Slope_MERIT",
+                "elevation_30s": "Elevation_MERIT",
+                "pr_30s": "P_CHELSA",
+                "pet_30s": "PET_CHELSA",
+                "landform": "WorldLandform"}
 
 caravan_path = "data/complete_table.csv"
 
@@ -35,31 +41,10 @@ if not os.path.isdir(results_path):
 # load and process data
 df = pd.read_csv(caravan_path, sep=',')
 
-coord_list = [(x, y) for x, y in zip(df['gauge_lon'], df['gauge_lat'])]
-
-df['slope_30s'] = [x for x in slope.sample(coord_list)]
-df['slope_30s'] = np.concatenate(df['slope_30s'].to_numpy())
-df.loc[df["slope_30s"] < 0, "slope_30s"] = np.nan
-df['slope_30s'] = np.tan(np.deg2rad(df['slope_30s'] * 0.01))
-
-df['elevation_30s'] = [x for x in elevation.sample(coord_list)]
-df['elevation_30s'] = np.concatenate(df['elevation_30s'].to_numpy())
-df.loc[df["elevation_30s"] < -1000, "elevation_30s"] = np.nan
-
-df['pr_30s'] = [x for x in pr.sample(coord_list)]
-df['pr_30s'] = np.concatenate(df['pr_30s'].to_numpy())
-df.loc[df["pr_30s"] > 50000, "pr_30s"] = np.nan
-df['pr_30s'] = df['pr_30s'] * 0.1
-
-df['pet_30s'] = [x for x in pet.sample(coord_list)]
-df['pet_30s'] = np.concatenate(df['pet_30s'].to_numpy())
-df.loc[df["pet_30s"] > 50000, "pet_30s"] = np.nan
-df['pet_30s'] = df['pet_30s'] * 0.01 * 12
-
-df['landform'] = [x for x in landform.sample(coord_list)]
-df['landform'] = np.concatenate(df['landform'].to_numpy())
-df.loc[df["landform"] < 1, "landform"] = np.nan
-df.loc[df["landform"] > 4, "landform"] = np.nan
+# extract point values from all rasters at once
+values = sample_points(stack, df['gauge_lon'], df['gauge_lat'])
+for i, var in enumerate(var_list):
+    df[var] = mask_and_scale(values[:, i], var_products[var])
 
 df["aridity_30s"] = df["pet_30s"]/df["pr_30s"]
 
@@ -1,8 +1,9 @@
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import rasterio as rio
 from functions import plotting_fcts
+from functions.products import mask_and_scale
+from functions.raster_stack import RasterStack, sample_points
 import os
 import seaborn as sns
 
@@ -30,41 +31,22 @@ def create_dataframe(data_path):
     # open all datasets
     df = pd.read_csv(data_path + "WTD_Fan_2013.csv", sep=',')
 
-    pr_30s = rio.open(pr_30s_path, masked=True)
-    pet_30s = rio.open(pet_30s_path, masked=True)
-    slope_30s = rio.open(slope_30s_path, masked=True)
-    elevation_30s = rio.open(elevation_30s_path, masked=True)
-    landform = rio.open(landform_path, masked=True)
-
-    # extract point values from gridded files / shapefile
-    coord_list = [(x,y) for x,y in zip(df['lon'], df['lat'])]
-
-    df['pr_30s'] = [x for x in pr_30s.sample(coord_list)]
-    df['pet_30s'] = [x for x in pet_30s.sample(coord_list)]
-    df['slope_30s'] = [x for x in slope_30s.sample(coord_list)]
-    df['elevation_30s'] = [x for x in elevation_30s.sample(coord_list)]
-    df['landform'] = [x for x in landform.sample(coord_list)]
-
-    # transform to np.arrays and rescale variables
-    df['pr_30s'] = np.concatenate(df['pr_30s'].to_numpy())
-    df['pet_30s'] = np.concatenate(df['pet_30s'].to_numpy())
-    df['slope_30s'] = np.concatenate(df['slope_30s'].to_numpy())
-    df['elevation_30s'] = np.concatenate(df['elevation_30s'].to_numpy())
-    df['landform'] = np.concatenate(df['landform'].to_numpy())
-
-    # remove nodata values
+    var_list = ["pr_30s", "pet_30s", "slope_30s", "elevation_30s", "landform"]
+    path_list = [pr_30s_path, pet_30s_path, slope_30s_path, elevation_30s_path, landform_path]
+    stack = RasterStack(path_list, var_list)
+
+    # extract point values from all gridded files at once
+    values = sample_points(stack, df['lon'], df['lat'])
+
+    # remove nodata values and transform values (see functions/products.py)
+    var_products = {"pr_30s": "P_CHELSA",
+                    "pet_30s": "PET_CHELSA",
+                    "slope_30s": "Slope_MERIT",
+                    "elevation_30s": "Elevation_MERIT",
+                    "landform": "WorldLandform"}
+    for i, var in enumerate(var_list):
+        df[var] = mask_and_scale(values[:, i], var_products[var])
     df.loc[df["wtd"] > 9000, "pr_30s"] = np.nan # 9999
-    df.loc[df["pr_30s"] > 50000, "pr_30s"] = np.nan # 65535
-    df.loc[df["pet_30s"] > 50000, "pet_30s"] = np.nan # 65535
-    df.loc[df["slope_30s"] < 0, "slope_30s"] = np.nan # -32768
-    df.loc[df["elevation_30s"] < -1000, "elevation_30s"] = np.nan # -9999
-    df.loc[df["landform"] < 1, "landform"] = np.nan
-    df.loc[df["landform"] > 4, "landform"] = np.nan
-
-    # transform values
-    df['pr_30s'] = df['pr_30s'] * 0.1
-    df['pet_30s'] = df['pet_30s'] * 0.01 * 12
-    df['slope_30s'] = np.tan(np.deg2rad(df['slope_30s'] * 0.01))
 
     df['aridity_30s'] = df['pet_30s']/df['pr_30s']
 
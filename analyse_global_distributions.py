@@ -1,19 +1,26 @@
+import os
+import functools
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import rioxarray as rxr
 import seaborn as sns
+from functions.raster_stack import RasterStack
+from functions.zonal_stats import chunk_windows, valid_cells
+from functions.parallel import map_windows
+from functions.products import get_valid_ranges, mask_and_scale
+from functions.parquet_table import write_table, read_table, lat_bands
 
 # Calculates global distribution and average slopes of landforms based on Karagulle et al. (2017) and Pelletier et al. (2016).
 
 # specify paths
 data_path = "./data/"
 results_path = "./results/"
+n_workers = os.cpu_count() # number of parallel worker processes for make_dataframe
 
 #if not os.path.isdir(results_path):
 #    os.makedirs(results_path)
 
-def make_dataframe(data_path):
+def make_dataframe(data_path, n_workers=1):
     # run on server
 
     source_data_path = "/home/hydrosys/data/"
@@ -30,66 +37,50 @@ def make_dataframe(data_path):
     var_list = ["pr_30s", "pet_30s", "slope_30s", "elevation_30s", "landform", "pelletier"]
     path_list = [pr_path, pet_path, slope_path, elevation_path, landform_path, pelletier_path]
 
-    df = pd.DataFrame(columns=["y", "x"])
-    for var, path in zip(var_list, path_list):
-        rds = rxr.open_rasterio(path)
-        rds = rds.squeeze().drop("spatial_ref").drop("band")
-        rds.name = var
-        df_tmp = rds.to_dataframe().reset_index()
-        # df_tmp["y"] = np.round(df_tmp["y"],4) # because of small coordinate differences...
-        # df_tmp["x"] = np.round(df_tmp["x"],4)
-        df = pd.merge(df, df_tmp, on=['y', 'x'], how='outer')
-
-    df.rename(columns={'x': 'lon', 'y': 'lat'}, inplace=True)
-
-    print("Done with merging.")
-
-    # remove nodata values
-    df.loc[df["pr_30s"] > 50000, "pr_30s"] = np.nan
-    df.loc[df["pet_30s"] > 50000, "pet_30s"] = np.nan
-    df.loc[df["slope_30s"] < 0, "slope_30s"] = np.nan
-    df.loc[df["elevation_30s"] < -1000, "elevation_30s"] = np.nan
-    df.loc[df["landform"] < 1, "landform"] = np.nan
-    df.loc[df["landform"] > 4, "landform"] = np.nan
-    df.loc[df["pelletier"] < 1, "pelletier"] = np.nan
-    df.loc[df["pelletier"] > 4, "pelletier"] = np.nan
-
-    # df = df.dropna()
-    df = df.dropna().reset_index()
+    # all layers share one grid, so cells are joined by array index instead of merging on coordinates
+    stack = RasterStack(path_list, var_list)
+
+    # nodata values, offset, and scale of each product (see functions/products.py)
+    var_products = {"pr_30s": "P_CHELSA",
+                    "pet_30s": "PET_CHELSA",
+                    "slope_30s": "Slope_MERIT",
+                    "elevation_30s": "Elevation_MERIT",
+                    "landform": "WorldLandform",
+                    "pelletier": "Pelletier"}
+    valid_range = get_valid_ranges(var_products)
+
+    # tiles are read in parallel, each worker returns the valid cells (incl. grid cell area) of its tile
+    # with compact types: landform and pelletier as uint8 with a validity bitmask (bit 0 landform, bit 1
+    # pelletier), other layers as float32, and row/col indices instead of lon/lat (see valid_cells)
+    function = functools.partial(valid_cells, stack, valid_range=valid_range,
+                                 class_layers=["landform", "pelletier"], coords="rowcol")
+    tiles = sorted(map_windows(function, chunk_windows(stack, rows_per_chunk=1200), n_workers), key=lambda t: t[0])
+    df = pd.concat([tile for i, tile in tiles], ignore_index=True)
+    del tiles
+
+    print("Done with loading.")
 
     # transform values
-    df['pr_30s'] = df['pr_30s'] * 0.1
-    df['pet_30s'] = df['pet_30s'] * 0.01 * 12
-    df['slope_30s'] = np.tan(np.deg2rad(df['slope_30s'] * 0.01))
+    for var in ["pr_30s", "pet_30s", "slope_30s"]:
+        df[var] = mask_and_scale(df[var].to_numpy(), var_products[var])
     df['aridity_30s'] = df['pet_30s'] / df['pr_30s']
 
     print("Done with transformations.")
 
-    # account for grid cell size
-    df_new = []
-    # loop over lat,lon
-    for x, y in zip(df["lon"], df["lat"]):
-        # https://gis.stackexchange.com/questions/421231/how-can-i-calculate-the-area-of-a-5-arcminute-grid-cell-in-square-kilometers-gi
-        # 1 degree of latitude = 111.567km. This varies very slightly by latitude, but we'll ignore that
-        # 5 arcminutes of latitude is 1/12 of that, so 9.297km
-        # 5 arcminutes of longitude is similar, but multiplied by cos(latitude) if latitude is in radians, or cos(latitude/360 * 2 * 3.14159) if in degrees
-        # we have half a degree here
-        y_len = 111.567/60/2 #/12 #
-        x_len = y_len * np.cos(y/360 * 2 * np.pi)
-        df_new.append([x_len, y_len])
-    df_new = pd.DataFrame(df_new)
-    df_new["area"] = df_new[0]*df_new[1]
-    df["area"] = df_new["area"]
-
-    print("Total land area: ", str(df["area"].sum()))
-
-    df.to_csv(data_path + 'global_data.csv', index=False)
+    print("Total land area: ", str(df.loc[df["valid"] == 3, "area"].sum()))
+
+    # partitioned by landform and 10 degree latitude band, with compact types (see functions/parquet_table.py)
+    lat = stack.xy(np.arange(stack.height), np.zeros(stack.height))[1]  # latitude of each row
+    df["lat_band"] = lat_bands(lat)[df["row"].to_numpy()]
+    write_table(df, data_path + 'global_data.parquet')
 
     print("Done.")
 
-#make_dataframe(data_path)
+#make_dataframe(data_path, n_workers=n_workers)
 
-df = pd.read_csv(data_path + 'global_data.csv')
+# only the columns needed for the summaries are loaded, and only cells with valid landform and pelletier class
+df = read_table(data_path + 'global_data.parquet', columns=["landform", "pelletier", "slope_30s", "aridity_30s", "area"],
+                filters=[("valid", "==", 3)])
 
 df["dummy"] = ""
 
@@ -1,148 +1,98 @@
 import numpy as np
 
-# This function calculates averages per latitude, i.e. it selects all cells with the same
-# latitude and calculates the average (arithmetic mean). It optionally also uses a moving
-# window to calculate smoother averages over multiple latitudinal values.
+# These functions calculate averages (medians) per latitude, i.e. they select all cells with the
+# same latitude and calculate the average (median). They optionally also use a moving window of
+# nr_cells latitudinal values (an odd number) to calculate smoother averages (medians). Close to
+# the first and last latitude, the window only extends to one side (e.g. for nr_cells=5, the
+# first value is averaged over the first three latitudes).
+# The values are sorted by latitude once, so that every latitude is a contiguous segment.
 
-# todo: write function that works for all cases
 
-def mean_group(vA0, vB0, nr_cells=1, thresh=1):
-    vA, ind, counts = np.unique(vA0, return_index=True, return_counts=True) # get unique values in vA0
-    vB = np.empty(len(vA))
-    vB[:] = np.nan
+def _sort_groups(vA0, vB0):
+    # sort values by group and get start and size of each group segment
+    vA0 = np.asarray(vA0)
+    vB0 = np.asarray(vB0, dtype=np.float64)
+    order = np.argsort(vA0, kind="stable")
+    vA, ind, counts = np.unique(vA0[order], return_index=True, return_counts=True)
+
+    return vA, ind, counts, order, vB0
+
+
+def _window_bounds(n, nr_cells):
+    # first and last group of the window around each group
+    if nr_cells < 1 or nr_cells % 2 == 0:
+        raise ValueError('nr_cells parameter needs to be an odd number (e.g. 1, 3, or 5).')
+    h = nr_cells // 2
+    i = np.arange(n)
+    lower = np.where(i < h, i, i - h)
+    upper = np.where(i < h, i + h, np.where(i > n - 1 - h, i, i + h))
+    lower = np.clip(lower, 0, n - 1)
+    upper = np.clip(upper, 0, n - 1)
 
+    return lower, upper
+
+
+def mean_group(vA0, vB0, nr_cells=1, thresh=1):
     if nr_cells == 1:
-    # calculate average per latitudinal cell
         thresh = 1
-        for i in range(len(vA)):
-            if len(vB0[np.where(vA0==vA[i])]) > thresh:
-                vB[i] = np.nanmean(vB0[np.where(vA0==vA[i])])
-
-    elif nr_cells == 3:
-    # calculate average per latitudinal cell using a window of 3 cells, i.e. one before and one after
-        for i in range(len(vA)):
-            if i < 1:
-                tmp2 = [vB0[np.where(vA0 == vA[i])]]
-                tmp3 = [vB0[np.where(vA0 == vA[i + 1])]]
-                tmp = np.concatenate((tmp2, tmp3), axis=None)
-                if len(tmp) > thresh:
-                    vB[i] = np.nanmean(tmp)
-            elif i > (len(vA) - 2):
-                tmp1 = [vB0[np.where(vA0 == vA[i - 1])]]
-                tmp2 = [vB0[np.where(vA0 == vA[i])]]
-                tmp = np.concatenate((tmp1, tmp2), axis=None)
-                if len(tmp) > thresh:
-                    vB[i] = np.nanmean(tmp)
-            else:
-                tmp1 = [vB0[np.where(vA0 == vA[i - 1])]]
-                tmp2 = [vB0[np.where(vA0 == vA[i])]]
-                tmp3 = [vB0[np.where(vA0 == vA[i + 1])]]
-                tmp = np.concatenate((tmp1, tmp2, tmp3), axis=None)
-                if len(tmp) > thresh:
-                    vB[i] = np.nanmean(tmp)
-
-    elif nr_cells == 5:
-    # calculate average per latitudinal cell using a window of 5 cells, i.e. two before and two after
-        for i in range(len(vA)):
-            if i < 2:
-                tmp2 = [vB0[np.where(vA0 == vA[i])]]
-                tmp3 = [vB0[np.where(vA0 == vA[i + 1])]]
-                tmp4 = [vB0[np.where(vA0 == vA[i + 2])]]
-                tmp = np.concatenate((tmp2, tmp3, tmp4), axis=None)
-                if len(tmp) > thresh:
-                    vB[i] = np.nanmean(tmp)
-            elif i > (len(vA) - 3):
-                tmp0 = [vB0[np.where(vA0 == vA[i - 2])]]
-                tmp1 = [vB0[np.where(vA0 == vA[i - 1])]]
-                tmp2 = [vB0[np.where(vA0 == vA[i])]]
-                tmp = np.concatenate((tmp0, tmp1, tmp2), axis=None)
-                if len(tmp) > thresh:
-                    vB[i] = np.nanmean(tmp)
-            else:
-                tmp0 = [vB0[np.where(vA0 == vA[i - 2])]]
-                tmp1 = [vB0[np.where(vA0 == vA[i - 1])]]
-                tmp2 = [vB0[np.where(vA0 == vA[i])]]
-                tmp3 = [vB0[np.where(vA0 == vA[i + 1])]]
-                tmp4 = [vB0[np.where(vA0 == vA[i + 2])]]
-                tmp = np.concatenate((tmp0, tmp1, tmp2, tmp3, tmp4), axis=None)
-                if len(tmp) > thresh:
-                    vB[i] = np.nanmean(tmp)
 
-    else:
-        print('nr_cells parameter needs to be either 1, 3, or 5.')
+    vA, ind, counts, order, vB0 = _sort_groups(vA0, vB0)
+    vB = np.full(len(vA), np.nan)
+    if len(vA) == 0:
+        return vA, vB
+
+    # sums and counts per group (NaN values are counted for thresh, but not for the mean)
+    vB_sorted = vB0[order]
+    isnan = np.isnan(vB_sorted)
+    group_sum = np.add.reduceat(np.where(isnan, 0, vB_sorted), ind)
+    group_valid = np.add.reduceat(~isnan, ind)
+
+    # sums and counts over the window of groups
+    lower, upper = _window_bounds(len(vA), nr_cells)
+    window_sum = np.zeros(len(vA))
+    window_valid = np.zeros(len(vA), dtype=np.int64)
+    window_count = np.zeros(len(vA), dtype=np.int64)
+    for k in range(-(nr_cells // 2), nr_cells // 2 + 1):
+        j = np.arange(len(vA)) + k
+        inside = (j >= lower) & (j <= upper)
+        j = np.clip(j, 0, len(vA) - 1)
+        window_sum += np.where(inside, group_sum[j], 0)
+        window_valid += np.where(inside, group_valid[j], 0)
+        window_count += np.where(inside, counts[j], 0)
+
+    ok = (window_count > thresh) & (window_valid > 0)
+    vB[ok] = window_sum[ok] / window_valid[ok]
 
     return vA, vB
 
 
-# This function calculates median values per latitude, i.e. it selects all cells with
-# the same latitude and calculates the median. It optionally also uses a moving window
-# to calculate smoother median over multiple latitudinal values.
-
-# todo: write function that works for all cases
-
 def median_group(vA0, vB0, nr_cells=1, thresh=1):
-    vA, ind, counts = np.unique(vA0, return_index=True, return_counts=True) # get unique values in vA0
-    vB = np.empty(len(vA))
-    vB[:] = np.nan
-
     if nr_cells == 1:
-    # calculate average per latitudinal cell
         thresh = 1
-        for i in range(len(vA)):
-            if len(vB0[np.where(vA0==vA[i])]) > thresh:
-                vB[i] = np.nanmedian(vB0[np.where(vA0==vA[i])])
-
-    elif nr_cells == 3:
-    # calculate average per latitudinal cell using a window of 3 cells, i.e. one before and one after
-        for i in range(len(vA)):
-            if i < 1:
-                tmp2 = [vB0[np.where(vA0 == vA[i])]]
-                tmp3 = [vB0[np.where(vA0 == vA[i + 1])]]
-                tmp = np.concatenate((tmp2, tmp3), axis=None)
-                if len(tmp) > thresh:
-                    vB[i] = np.nanmedian(tmp)
-            elif i > (len(vA) - 2):
-                tmp1 = [vB0[np.where(vA0 == vA[i - 1])]]
-                tmp2 = [vB0[np.where(vA0 == vA[i])]]
-                tmp = np.concatenate((tmp1, tmp2), axis=None)
-                if len(tmp) > thresh:
-                    vB[i] = np.nanmedian(tmp)
-            else:
-                tmp1 = [vB0[np.where(vA0 == vA[i - 1])]]
-                tmp2 = [vB0[np.where(vA0 == vA[i])]]
-                tmp3 = [vB0[np.where(vA0 == vA[i + 1])]]
-                tmp = np.concatenate((tmp1, tmp2, tmp3), axis=None)
-                if len(tmp) > thresh:
-                    vB[i] = np.nanmedian(tmp)
-
-    elif nr_cells == 5:
-    # calculate average per latitudinal cell using a window of 5 cells, i.e. two before and two after
-        for i in range(len(vA)):
-            if i < 2:
-                tmp2 = [vB0[np.where(vA0 == vA[i])]]
-                tmp3 = [vB0[np.where(vA0 == vA[i + 1])]]
-                tmp4 = [vB0[np.where(vA0 == vA[i + 2])]]
-                tmp = np.concatenate((tmp2, tmp3, tmp4), axis=None)
-                if len(tmp) > thresh:
-                    vB[i] = np.nanmedian(tmp)
-            elif i > (len(vA) - 3):
-                tmp0 = [vB0[np.where(vA0 == vA[i - 2])]]
-                tmp1 = [vB0[np.where(vA0 == vA[i - 1])]]
-                tmp2 = [vB0[np.where(vA0 == vA[i])]]
-                tmp = np.concatenate((tmp0, tmp1, tmp2), axis=None)
-                if len(tmp) > thresh:
-                    vB[i] = np.nanmedian(tmp)
-            else:
-                tmp0 = [vB0[np.where(vA0 == vA[i - 2])]]
-                tmp1 = [vB0[np.where(vA0 == vA[i - 1])]]
-                tmp2 = [vB0[np.where(vA0 == vA[i])]]
-                tmp3 = [vB0[np.where(vA0 == vA[i + 1])]]
-                tmp4 = [vB0[np.where(vA0 == vA[i + 2])]]
-                tmp = np.concatenate((tmp0, tmp1, tmp2, tmp3, tmp4), axis=None)
-                if len(tmp) > thresh:
-                    vB[i] = np.nanmedian(tmp)
 
+    vA, ind, counts, order, vB0 = _sort_groups(vA0, vB0)
+    vB = np.full(len(vA), np.nan)
+    if len(vA) == 0:
+        return vA, vB
+
+    # segment of each window in the sorted values (groups are contiguous)
+    vB_sorted = vB0[order]
+    ends = ind + counts
+    lower, upper = _window_bounds(len(vA), nr_cells)
+    window_count = ends[upper] - ind[lower]
+
+    if nr_cells == 1:
+        # sort values within each group (NaN values at the end) and pick the middle values
+        vB_sorted = vB_sorted[np.lexsort((vB_sorted, np.repeat(np.arange(len(vA)), counts)))]
+        valid = np.add.reduceat(~np.isnan(vB_sorted), ind)
+        ok = (window_count > thresh) & (valid > 0)
+        lo = ind[ok] + (valid[ok] - 1) // 2
+        hi = ind[ok] + valid[ok] // 2
+        vB[ok] = (vB_sorted[lo] + vB_sorted[hi]) / 2
     else:
-        print('nr_cells parameter needs to be either 1, 3, or 5.')
+        for i in np.flatnonzero(window_count > thresh):
+            window = vB_sorted[ind[lower[i]]:ends[upper[i]]]
+            if not np.isnan(window).all():
+                vB[i] = np.nanmedian(window)
 
     return vA, vB
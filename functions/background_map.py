@@ -0,0 +1,83 @@
+import os
+import json
+import hashlib
+import numpy as np
+import rasterio as rio
+import matplotlib.pyplot as plt
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+from functions.raster_stack import read_decimated
+from functions.file_cache import file_fingerprint, atomic_savez, load_npz_or_none
+
+# This script contains functions to plot a raster (e.g. a global 30 arc-second DEM) as background
+# map of a region. Only the window of the region is read, at the resolution of the figure: the
+# coarsest overview level that is still fine enough is used (if the raster has overviews, see
+# read_decimated in functions/raster_stack.py) and the window is decimated to the number of pixels
+# of the figure. The result can be cached per region.
+
+
+def background_cache_key(path, bounds, out_shape, resampling):
+    '''Hash of the raster file, the requested bounds and shape, and the resampling method'''
+
+    content = {"raster": file_fingerprint(path),
+               "bounds": [float(b) for b in bounds], "out_shape": [int(n) for n in out_shape],
+               "resampling": resampling.name}
+
+    return hashlib.sha256(json.dumps(content).encode()).hexdigest()
+
+
+def read_background(path, xlim, ylim, resolution=(2400, 2400), margin=0.25, cache_dir=None,
+                    resampling=Resampling.average):
+    '''Values (NaN for nodata) and extent of the region xlim, ylim, read at about the given resolution'''
+
+    # resolution is the number of (x, y) pixels of the region in the figure, the region is extended
+    # by margin times its size on each side (e.g. for axis('equal'), which can show a larger area)
+    dx, dy = xlim[1] - xlim[0], ylim[1] - ylim[0]
+    bounds = [xlim[0] - margin * dx, ylim[0] - margin * dy, xlim[1] + margin * dx, ylim[1] + margin * dy]
+    cell_x, cell_y = dx / resolution[0], dy / resolution[1]  # coarsest cell size that is still needed
+
+    with rio.open(path) as src:
+        # window of the region (clipped to the raster)
+        col0, row0 = ~src.transform * (bounds[0], bounds[3])
+        col1, row1 = ~src.transform * (bounds[2], bounds[1])
+        col0, row0 = max(int(np.floor(col0)), 0), max(int(np.floor(row0)), 0)
+        col1, row1 = min(int(np.ceil(col1)), src.width), min(int(np.ceil(row1)), src.height)
+        if col1 <= col0 or row1 <= row0:
+            raise ValueError('Region ' + str(xlim) + ', ' + str(ylim) + ' does not overlap with ' + path + '.')
+        window = Window(col0, row0, col1 - col0, row1 - row0)
+        left, top = src.transform * (col0, row0)
+        right, bottom = src.transform * (col1, row1)
+        extent = [left, right, bottom, top]
+
+    # decimate to the figure resolution (never upsample)
+    out_shape = (max(1, min(window.height, int(np.ceil(abs(top - bottom) / cell_y)))),
+                 max(1, min(window.width, int(np.ceil(abs(right - left) / cell_x)))))
+
+    if cache_dir is not None:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        cache_path = os.path.join(cache_dir, "background_" +
+                                  background_cache_key(path, extent, out_shape, resampling) + ".npz")
+        cached = load_npz_or_none(cache_path)
+        if cached is not None and "data" in cached and "extent" in cached:
+            return cached["data"], list(cached["extent"])
+
+    data = read_decimated(path, window, out_shape, resampling, masked=True)
+    data = data.astype(np.float32).filled(np.nan)
+
+    if cache_dir is not None:
+        atomic_savez(cache_path, data=data, extent=np.array(extent))
+
+    return data, extent
+
+
+def plot_background(ax, path, xlim, ylim, dpi=600, margin=0.25, cache_dir=None, **kwargs):
+    '''Plot the region xlim, ylim of a raster (with colorbar) at the resolution of the figure of ax'''
+
+    # the region is read at figure size x dpi pixels (see read_background), kwargs are passed to imshow
+    resolution = ax.figure.get_size_inches() * dpi
+    data, extent = read_background(path, xlim, ylim, resolution, margin, cache_dir)
+    image = ax.imshow(data, extent=extent, origin="upper", interpolation="nearest", **kwargs)
+    plt.colorbar(image, ax=ax)
+
+    return image
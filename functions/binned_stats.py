@@ -0,0 +1,61 @@
+import numpy as np
+
+# This script contains exact binned statistics (count, mean, std, median, and quantiles of y in
+# bins of x), calculated in one pass after sorting once by bin and value. It only depends on numpy,
+# so that it can be used in worker processes without the plotting or raster dependencies (see
+# functions/quantile_sketch.py for approximate statistics with bounded memory).
+
+
+def assign_bins(x, bin_edges):
+    # bin numbers as in scipy.stats.binned_statistic (0 and len(bin_edges) are outside of all bins)
+    binnumber = np.searchsorted(bin_edges, x, side="right")
+    binnumber[x == bin_edges[-1]] -= 1
+
+    return binnumber
+
+
+def binned_stats(x, y, bin_edges, quantiles=()):
+    """Count, mean, std, median, and quantiles of y in bins of x in one pass (NaN values of y are ignored)"""
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    bin_edges = np.asarray(bin_edges, dtype=np.float64)
+    n_bins = len(bin_edges) - 1
+
+    # assign bins once (0 is left of the first bin, n_bins+1 right of the last bin)
+    binnumber = assign_bins(x, bin_edges)
+
+    # sort once by (bin, value), so that each bin is a sorted segment
+    use = (binnumber >= 1) & (binnumber <= n_bins) & ~np.isnan(y)
+    b = binnumber[use] - 1
+    v = y[use]
+    order = np.lexsort((v, b))
+    b = b[order]
+    v = v[order]
+
+    count = np.bincount(b, minlength=n_bins)
+    start = np.concatenate(([0], np.cumsum(count)[:-1]))
+    full = count > 0
+
+    mean = np.full(n_bins, np.nan)
+    mean[full] = np.bincount(b, weights=v, minlength=n_bins)[full] / count[full]
+    std = np.full(n_bins, np.nan)
+    std[full] = np.sqrt(np.bincount(b, weights=(v - mean[b]) ** 2, minlength=n_bins)[full] / count[full])
+
+    median = np.full(n_bins, np.nan)
+    median[full] = (v[start[full] + (count[full] - 1) // 2] + v[start[full] + count[full] // 2]) / 2
+
+    # quantiles with linear interpolation between the closest ranks (as np.nanquantile)
+    quantile_stats = np.full((len(quantiles), n_bins), np.nan)
+    for i, q in enumerate(quantiles):
+        pos = q * (count[full] - 1)
+        lower = np.floor(pos).astype(np.int64)
+        upper = np.ceil(pos).astype(np.int64)
+        t = pos - lower
+        v_lower = v[start[full] + lower]
+        v_upper = v[start[full] + upper]
+        diff = v_upper - v_lower
+        quantile_stats[i, full] = np.where(t >= 0.5, v_upper - diff * (1 - t), v_lower + diff * t)
+
+    return {"count": count, "mean": mean, "std": std, "median": median,
+            "quantiles": quantile_stats, "binnumber": binnumber}
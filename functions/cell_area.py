@@ -0,0 +1,60 @@
+import numpy as np
+from functools import lru_cache
+
+# This script contains functions to calculate the area of grid cells of a regular lat/lon grid.
+# The area only depends on latitude, so it is calculated once per row and broadcast to the grid.
+
+# WGS84 ellipsoid
+a_km = 6378.137
+f = 1 / 298.257223563
+
+
+@lru_cache(maxsize=32)
+def _row_area(lat_top, res_y, res_x, height, ellipsoid):
+    # area per row in km^2, cached per grid (origin, resolution, and number of rows)
+
+    lat_edges = lat_top - np.abs(res_y) * np.arange(height + 1)
+
+    if ellipsoid:
+        # exact area of an ellipsoidal band between two latitudes
+        e = np.sqrt(f * (2 - f))
+        b_km = a_km * (1 - f)
+        sin_lat = np.sin(np.deg2rad(np.clip(lat_edges, -90, 90)))
+        q = sin_lat / (1 - (e * sin_lat) ** 2) + np.log((1 + e * sin_lat) / (1 - e * sin_lat)) / (2 * e)
+        area = b_km ** 2 * np.deg2rad(np.abs(res_x)) / 2 * np.abs(q[:-1] - q[1:])
+    else:
+        # https://gis.stackexchange.com/questions/421231/how-can-i-calculate-the-area-of-a-5-arcminute-grid-cell-in-square-kilometers-gi
+        # 1 degree of latitude = 111.567km. This varies very slightly by latitude, but we'll ignore that
+        # 1 degree of longitude is similar, but multiplied by cos(latitude)
+        lat_centres = (lat_edges[:-1] + lat_edges[1:]) / 2
+        y_len = 111.567 * np.abs(res_y)
+        x_len = 111.567 * np.abs(res_x) * np.cos(np.deg2rad(lat_centres))
+        area = x_len * y_len
+
+    area.flags.writeable = False
+
+    return area
+
+
+def cell_area_rows(grid, window=None, ellipsoid=False):
+    '''Area of the grid cells in km^2 per row (1-D array)'''
+
+    transform = grid.transform
+    if transform.b != 0 or transform.d != 0:
+        raise ValueError('Rotated grids are not supported.')
+
+    area = _row_area(transform.f, transform.e, transform.a, grid.height, ellipsoid)
+    if window is not None:
+        area = area[int(window.row_off):int(window.row_off) + int(window.height)]
+
+    return area
+
+
+def cell_area(grid, window=None, ellipsoid=False):
+    '''Area of the grid cells in km^2 as (row, col) array (read-only view, no copy per column)'''
+
+    # grid is anything with transform, height, and width (e.g. RasterStack or rasterio dataset)
+    area = cell_area_rows(grid, window, ellipsoid)
+    width = grid.width if window is None else int(window.width)
+
+    return np.broadcast_to(area[:, np.newaxis], (len(area), width))
@@ -2,15 +2,26 @@ from shapely.geometry import mapping
 from shapely import geometry
 import fiona
 
-def create_line_shp(xy_line, path="/shapefiles/line.shp"):
+def create_line(xy_line):
+    # line from (xy_line[0], xy_line[2]) to (xy_line[1], xy_line[3]), kept in memory
 
-    line = geometry.LineString([geometry.Point(xy_line[0], xy_line[2]),
+    return geometry.LineString([geometry.Point(xy_line[0], xy_line[2]),
                                 geometry.Point(xy_line[1], xy_line[3])])
 
+def create_line_shp(xy_line, path="/shapefiles/line.shp"):
+
+    create_lines_shp([create_line(xy_line)], path, ids=[123])
+
+def create_lines_shp(lines, path="/shapefiles/lines.shp", ids=None):
+    # write several lines (e.g. the baselines of all swaths of a region) into one shapefile
+
+    if ids is None:
+        ids = range(len(lines))
+
     schema = {'geometry': 'LineString', 'properties': {'id': 'int'}}
     # write a new shapefile
     with fiona.open(path, 'w', 'ESRI Shapefile', schema) as c:
-        c.write({'geometry': mapping(line), 'properties': {'id': 123}})
+        c.writerecords([{'geometry': mapping(line), 'properties': {'id': int(i)}} for line, i in zip(lines, ids)])
 
 def create_polygon_shp(polygon, path="/shapefiles/polygon.shp"):
 
@@ -0,0 +1,53 @@
+import numpy as np
+from scipy import stats
+from functions.binned_stats import assign_bins, binned_stats
+
+# This script contains functions to aggregate several variables (e.g. P, PET, and aridity of a
+# swath or a mountain range) in elevation bands. Bins are assigned once from the elevation and the
+# statistics of all variables are calculated together. Bands either have a fixed width between the
+# lowest and the highest elevation or contain the same number of values (elevation quantiles).
+
+
+def elevation_band_edges(elevation, n_bins=10, mode="width"):
+    '''Edges of n_bins elevation bands of fixed width ("width") or with equal counts ("count")'''
+
+    elevation = np.asarray(elevation, dtype=np.float64).ravel()
+    elevation = elevation[~np.isnan(elevation)]
+    if mode == "width":
+        return np.linspace(np.min(elevation), np.max(elevation), n_bins + 1)
+    elif mode == "count":
+        return np.asarray(stats.mstats.mquantiles(elevation, np.linspace(0, 1, n_bins + 1)))
+    else:
+        raise ValueError('Mode ' + str(mode) + ' not defined.')
+
+
+def elevation_bands(elevation, variables, n_bins=10, mode="width", bin_edges=None, quantiles=()):
+    '''Count, mean, std, and quantiles of several variables in elevation bands'''
+
+    # variables maps a name to an array with the same shape as elevation, NaN values are ignored per
+    # variable (as np.nanmean, np.nanstd, and np.nanquantile), given bin_edges are used instead of
+    # n_bins and mode, bins follow scipy.stats.binned_statistic (the last bin includes its right edge)
+    # returns the bin edges and for each variable a dict with (band,) arrays and (quantile, band) quantiles
+    elevation = np.asarray(elevation, dtype=np.float64).ravel()
+    if bin_edges is None:
+        bin_edges = elevation_band_edges(elevation, n_bins, mode)
+    bin_edges = np.asarray(bin_edges, dtype=np.float64)
+    n_bins = len(bin_edges) - 1
+    names = list(variables)
+    values = np.array([np.asarray(variables[name], dtype=np.float64).ravel() for name in names])
+
+    # assign bins once, then use variable x band as combined key for all variables (-1 outside of
+    # all bands), so that the statistics of all variables are calculated in one pass of binned_stats
+    binnumber = assign_bins(elevation, bin_edges)
+    inside = (binnumber >= 1) & (binnumber <= n_bins)
+    key = np.where(inside[np.newaxis, :], np.arange(len(names))[:, np.newaxis] * n_bins + binnumber - 1, -1)
+    n_keys = len(names) * n_bins
+    binned = binned_stats(key.ravel(), values.ravel(), np.arange(n_keys + 1) - 0.5, quantiles)
+
+    bands = {}
+    for i, name in enumerate(names):
+        band = slice(i * n_bins, (i + 1) * n_bins)
+        bands[name] = {"count": binned["count"][band], "mean": binned["mean"][band], "std": binned["std"][band],
+                       "quantiles": binned["quantiles"][:, band]}
+
+    return bin_edges, bands
@@ -0,0 +1,36 @@
+import os
+import zipfile
+import numpy as np
+
+# This script contains helpers for files that are kept between runs (e.g. the swath and background
+# caches under results/<region>/cache/, the checkpoints of functions/zonal_stats.py, and the
+# manifest of functions/resample.py): a fingerprint that changes whenever an input file is
+# rewritten, and NPZ writes that other processes never see half-written.
+
+
+def file_fingerprint(path):
+    '''Absolute path, modification time (ns), and size of a file'''
+
+    stat = os.stat(path)
+
+    return [os.path.abspath(path), stat.st_mtime_ns, stat.st_size]
+
+
+def atomic_savez(path, **arrays):
+    '''Write arrays to an NPZ file (a temporary file replaces the old file, so that it is never partial)'''
+
+    # the temporary file is unique per process, so that several processes can write the same entry
+    tmp_path = path + "." + str(os.getpid()) + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_npz_or_none(path):
+    '''All arrays of an NPZ file (None if the file does not exist or is broken)'''
+
+    try:
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        return None
@@ -2,6 +2,8 @@
 # (GNU General Public License v3.0; see https://www.gnu.org/licenses/gpl-3.0.html)
 
 import math
+import numpy as np
+from shapely.geometry import Polygon
 
 def perp_pts(x, y, m, edge_length, edges):
     '''Create points perpendicular to the line segment at a set distance'''
@@ -35,4 +37,48 @@ def perp_pts(x, y, m, edge_length, edges):
             x2 = x + (edge_length / math.sqrt(1 + m_perp ** 2))
             y2 = y + ((edge_length * m_perp) / math.sqrt(1 + m_perp ** 2))
 
-    return x1, y1, x2, y2
\ No newline at end of file
+    return x1, y1, x2, y2
+
+def perp_pts_line(xs, ys, edge_length):
+    '''Create points perpendicular to all segments of a line (given by its points) at their midpoints'''
+    # same points as perp_pts for every segment, but for all segments at once: point 1 lies on the
+    # southern side of a segment (northern side for flat segments, eastern side for vertical and
+    # zero-length segments) and point 2 on the opposite side
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    xx = (xs[1:] + xs[:-1]) / 2
+    yy = (ys[1:] + ys[:-1]) / 2
+    dx = np.diff(xs)
+    dy = np.diff(ys)
+
+    # the unit normal (dy, -dx) points south for segments going east, so it is flipped for segments
+    # going west, for vertical segments going south, and for flat segments
+    length = np.hypot(dx, dy)
+    flip = np.where(dx == 0, np.sign(dy), np.sign(dx))
+    flip = np.where(dy == 0, -flip, flip)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        nx = np.where(length > 0, flip * dy / length, 1.0)
+        ny = np.where(length > 0, -flip * dx / length, 0.0)
+
+    x1 = xx + edge_length * nx
+    y1 = yy + edge_length * ny
+    x2 = xx - edge_length * nx
+    y2 = yy - edge_length * ny
+
+    return xx, yy, x1, y1, x2, y2
+
+
+def perp_polygons(xs, ys, edge_length):
+    '''Create rectangles around all segments of a line, extending edge_length to both sides'''
+    xx, yy, x1, y1, x2, y2 = perp_pts_line(xs, ys, edge_length)
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    nx, ny = x1 - xx, y1 - yy
+
+    # corners of all rectangles at once, as (segment, corner, xy) array
+    corners = np.stack([np.column_stack((xs[:-1] + nx, ys[:-1] + ny)),
+                        np.column_stack((xs[1:] + nx, ys[1:] + ny)),
+                        np.column_stack((xs[1:] - nx, ys[1:] - ny)),
+                        np.column_stack((xs[:-1] - nx, ys[:-1] - ny))], axis=1)
+
+    return [Polygon(c) for c in corners]
@@ -1,37 +1,62 @@
 import numpy as np
+from functions.products import get_product
+from functions.sample_swath import interpolate_line, line_distance_km
 
-def get_swath_data(orig_dem, orig_pr, orig_pet, orig_t, line_shape):
-    # todo: clean up and make less hacky (especially nodata values)
-    dist = orig_dem.distance
-    dem_swath = np.array(orig_dem.dat)
-    if (len(dist) == len(dem_swath) + 1):  # sometimes dist is longer than swath
-        dist = orig_dem.distance[0:-1]
-    dem_swath[dem_swath == -32768.] = np.nan  # Note: works only because this is returned as nodata value (WorldClim DEM)
-    dem_swath[dem_swath == 32767.] = np.nan  # Note: works only because this is returned as nodata value (HydroSHEDS DEM)
-    dem_swath[dem_swath == -9999.] = np.nan  # Note: works only because this is returned as nodata value (MERIT 250m DEM)
-    isnan = np.isnan(dem_swath).any(axis=1)
-    dem_swath = dem_swath[~isnan]
-    # ma.masked_invalid(dem_swath)
-    pr_swath = orig_pr.dat
-    pr_swath = [d for (d, remove) in zip(pr_swath, isnan) if not remove]
-    pr_swath = np.array(pr_swath)
-    # pr_swath[pr_swath==-999] = np.nan
-    # ma.masked_invalid(pr_swath)
-    pet_swath = orig_pet.dat
-    pet_swath = [d for (d, remove) in zip(pet_swath, isnan) if not remove]
-    pet_swath = np.array(pet_swath)
-    #pet_swath[pet_swath == 65535.] = np.nan  # Note: works only because this is returned as nodata value (CHELSA PET)
-    #pet_swath[pet_swath == -32768.] = np.nan  # Note: works only because this is returned as nodata value (WorldClim PET)
-    #isnan2 = np.isnan(pet_swath).any(axis=1)
-    #pet_swath = pet_swath[~isnan2]
-    # pet_swath[pet_swath==-999] = np.nan
-    # pet_swath = pet_swath * 1000  # transform to Pa
-    # ma.masked_invalid(pet_swath)
-    t_swath = orig_t.dat
-    t_swath = [d for (d, remove) in zip(t_swath, isnan) if not remove]
-    t_swath = np.array(t_swath)
-    # t_swath[t_swath==-999] = np.nan
-    # ma.masked_invalid(t_swath)
-    dist = dist[~isnan] + line_shape.xy[0][0] # works only if line goes from east to west
-
-    return dist, dem_swath, pr_swath, pet_swath, t_swath
+# nodata values of the possible DEM products (see functions/products.py), used for the DEM if no nodata values are given
+dem_nodata = [get_product(product_name)["nodata"]
+              for product_name in ("Elevation_WorldClim", "Elevation_HydroSHEDS", "Elevation_MERIT")]
+
+def get_swath_data(swath_data, dist, line_shape, nodata=None, required=(0,), position="auto"):
+    # swath_data is a (raster, along, across) array (see functions/sample_swath.py), the first raster is the DEM
+    # nodata has one entry per raster: a value, a list of values, or None (default: dem_nodata for the DEM only)
+    # positions along the line where any of the required rasters (default: the DEM) has missing values are removed
+    # returns the position along the line (see swath_position) and one (along, across) array per raster,
+    # e.g. dist, dem_swath, pr_swath, pet_swath, t_swath
+    swath_data = np.array(swath_data, dtype=np.float64)
+    dist = np.asarray(dist)[0:swath_data.shape[1]]  # sometimes dist is longer than swath
+    if nodata is None:
+        nodata = [dem_nodata] + [None] * (len(swath_data) - 1)
+    if len(nodata) != len(swath_data):
+        raise ValueError('nodata needs one entry per raster.')
+
+    # set nodata values of every raster to NaN
+    for layer, values in zip(swath_data, nodata):
+        if values is not None:
+            layer[np.isin(layer, np.atleast_1d(values))] = np.nan
+
+    # one mask for all rasters, every raster is compacted with the same boolean index
+    valid = ~np.isnan(swath_data[list(required)]).any(axis=(0, 2))
+    swath_data = swath_data[:, valid]
+    dist = swath_position(line_shape, dist[valid], position)
+
+    return (dist, *swath_data)
+
+
+def swath_position(line_shape, dist, position="auto"):
+    # position of points at distance dist along the line: "km" (distance along the line on the WGS84
+    # ellipsoid), "lon" or "lat" of the points, "distance" along the line in degrees, or "auto" (longitude
+    # for lines that go rather east-west, latitude for lines that go rather north-south), works for lines
+    # in any direction
+    if position == "distance":
+        return dist
+    elif position == "km":
+        return line_distance_km(line_shape, dist)
+
+    if position == "auto":
+        (x0, y0), (x1, y1) = line_shape.coords[0][:2], line_shape.coords[-1][:2]
+        position = "lon" if abs(x1 - x0) >= abs(y1 - y0) else "lat"
+
+    px, py, _, _ = interpolate_line(line_shape, dist)
+    if position == "lon":
+        return px
+    elif position == "lat":
+        return py
+    else:
+        raise ValueError('Position ' + str(position) + ' not defined.')
+
+
+def stack_orig_curv(*origs):
+    # (raster, along, across) array and distance of pyosp swath objects (e.g. Orig_curv), for get_swath_data
+    swath_data = np.array([orig.dat for orig in origs], dtype=np.float64)
+
+    return swath_data, origs[0].distance
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+# This script contains functions to fit linear regressions of many profiles at once (e.g. binned
+# P and PET over elevation of hundreds of swaths). The fits are calculated in closed form for all
+# rows of a matrix at once and ignore NaN values (e.g. empty elevation bins).
+
+
+def linear_fits(x, y):
+    '''Slope, intercept, R^2, standard error of the slope, and number of points of a linear fit per row'''
+
+    # x and y are (row, point) arrays (x can also be 1-D if it is the same for all rows), rows with
+    # fewer than two points (three for the standard error) or without variation in x give NaN
+    y = np.asarray(y, dtype=np.float64)
+    x = np.broadcast_to(np.asarray(x, dtype=np.float64), y.shape)
+    valid = np.isfinite(x) & np.isfinite(y)
+    n = valid.sum(axis=1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x_mean = np.where(valid, x, 0).sum(axis=1) / n
+        y_mean = np.where(valid, y, 0).sum(axis=1) / n
+        dx = np.where(valid, x - x_mean[:, np.newaxis], 0)
+        dy = np.where(valid, y - y_mean[:, np.newaxis], 0)
+        sxx = (dx ** 2).sum(axis=1)
+        syy = (dy ** 2).sum(axis=1)
+        sxy = (dx * dy).sum(axis=1)
+
+        ok = (n >= 2) & (sxx > 0)
+        slope = np.where(ok, sxy / sxx, np.nan)
+        intercept = np.where(ok, y_mean - slope * x_mean, np.nan)
+        r2 = np.where(ok & (syy > 0), sxy ** 2 / (sxx * syy), np.nan)
+        rss = np.maximum(syy - slope * sxy, 0)
+        stderr = np.where(ok & (n > 2), np.sqrt(rss / (n - 2) / sxx), np.nan)
+
+    return {"slope": slope, "intercept": intercept, "r2": r2, "stderr": stderr, "n": n}
+
+
+def lapse_rates(elevation, profiles, index=None):
+    '''Table with lapse rate, intercept, R^2, and standard error of several (row, bin) profiles per row'''
+
+    # profiles maps a variable name (e.g. "P") to a (row, bin) array of binned means over elevation
+    results = pd.DataFrame(index=index)
+    for name, values in profiles.items():
+        fit = linear_fits(elevation, values)
+        results[name + "_lapse_rate"] = fit["slope"]
+        results[name + "_intercept"] = fit["intercept"]
+        results[name + "_r2"] = fit["r2"]
+        results[name + "_stderr"] = fit["stderr"]
+
+    return results
@@ -0,0 +1,34 @@
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# This script contains a generic process pool helper, which applies a function to many independent
+# items (e.g. raster windows, swaths, or files to resample) in parallel worker processes.
+
+
+def map_windows(function, windows, n_workers=1, fresh_process=False):
+    '''Apply function to all windows (or other items), in parallel if n_workers > 1, and yield (index, result)'''
+
+    # function needs to be picklable (e.g. a functools.partial of a module-level function); the
+    # workers open their own rasterio handles, since RasterStack opens the files for every read;
+    # fresh_process=True runs every item in a new worker process (also for n_workers=1), e.g. to
+    # measure the peak memory per item, this needs spawn and thus an if __name__ == "__main__"
+    # guard in the calling script
+    if n_workers == 1 and not fresh_process:
+        for i, window in enumerate(windows):
+            yield i, function(window)
+        return
+
+    # fork avoids re-running the calling script in every worker (spawn is used on Windows,
+    # where the calling script needs an if __name__ == "__main__" guard)
+    kwargs = {}
+    if fresh_process:
+        context = mp.get_context("spawn")  # fork does not allow to replace workers
+        kwargs["max_tasks_per_child"] = 1
+    elif "fork" in mp.get_all_start_methods():
+        context = mp.get_context("fork")
+    else:
+        context = mp.get_context()
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=context, **kwargs) as executor:
+        futures = {executor.submit(function, window): i for i, window in enumerate(windows)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
@@ -0,0 +1,64 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+# This script contains functions to store large tables (e.g. all valid land cells of the global
+# 30 arc-second rasters, see analyse_global_distributions.py) as partitioned Parquet datasets.
+# Values are stored with compact types and binary (no precision is lost as in CSV files), and
+# reads only load the requested columns and the partitions (and row groups) that match the filters.
+# Parquet needs pyarrow (pip install pyarrow).
+
+# compact types of the columns of the global table, other columns keep their type
+table_dtypes = {"pr_30s": np.float32,
+                "pet_30s": np.float32,
+                "slope_30s": np.float32,
+                "elevation_30s": np.float32,
+                "aridity_30s": np.float32,
+                "landform": np.uint8,
+                "pelletier": np.uint8,
+                "valid": np.uint8,
+                "lat_band": np.int16}
+
+
+def lat_bands(lat, band_size=10):
+    '''Lower edge of the latitude band (in degrees) of each latitude'''
+
+    return (np.floor(np.asarray(lat) / band_size) * band_size).astype(np.int16)
+
+
+def write_table(df, path, partition_cols=("landform", "lat_band"), band_size=10, dtypes=None):
+    '''Write a table as Parquet dataset with one directory per partition (e.g. landform and latitude band)'''
+
+    # "lat_band" is calculated from "lat" if it is a partition column but not in the table, the
+    # dataset is written to a temporary directory first, so that readers never see a partial dataset
+    if dtypes is None:
+        dtypes = table_dtypes
+    df = df.astype({col: dtype for col, dtype in dtypes.items() if col in df.columns})
+    if "lat_band" in partition_cols and "lat_band" not in df.columns:
+        df["lat_band"] = lat_bands(df["lat"], band_size)
+
+    tmp_path = path + ".tmp"
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+    df.to_parquet(tmp_path, partition_cols=list(partition_cols), index=False)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+
+
+def read_table(path, columns=None, filters=None, dtypes=None):
+    '''Read the given columns (default: all) of the rows of a Parquet dataset that match the filters'''
+
+    # filters are (column, operator, value) tuples, e.g. [("landform", "in", [1, 2, 3])], that are
+    # applied to the partitions and row groups before they are loaded
+    if dtypes is None:
+        dtypes = table_dtypes
+    df = pd.read_parquet(path, columns=columns, filters=filters)
+
+    # partition columns are read as categories, convert them back to their compact types
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(dtypes.get(col, np.int64))
+
+    return df
@@ -8,6 +8,9 @@ import shapely.geometry as sgeom
 from brewer2mpl import brewer2mpl
 import os
 from functools import reduce
+from collections import namedtuple
+from functions.binned_stats import binned_stats
+from functions.quantile_sketch import streaming_binned_stats, array_chunks
 
 # This script contains a collection of function that make or help with making plots.
 
@@ -76,13 +79,13 @@ def plot_bins_group(x, y, color="tab:blue", group_type="aridity_class", group="e
                 fmt='o', ms=4, elinewidth=1, c='black', ecolor='black', mec='black', mfc=color, alpha=0.9, label=corr_str)
 
 
-def plot_bins(x, y, fillcolor='black', **kwargs):
+def plot_bins(x, y, fillcolor='black', streaming=False, **kwargs):
 
     # calculate binned statistics
     bin_edges, \
     mean_stat, std_stat, median_stat, \
     p_05_stat, p_25_stat, p_75_stat, p_95_stat, \
-    asymmetric_error, bin_median = get_binned_stats(x, y)
+    asymmetric_error, bin_median = get_binned_stats(x, y, streaming=streaming)
 
     # plot bins
     ax = plt.gca()
@@ -98,53 +101,113 @@ def plot_bins(x, y, fillcolor='black', **kwargs):
                 c='white', zorder=10, fmt='none')
 
 
-def binned_stats_table(df, x_str, y_str, ghms):
+def grouped_mquantiles(x_sorted, start, count, prob, alphap=.4, betap=.4):
+    # scipy.stats.mstats.mquantiles of each sorted segment x_sorted[start:start+count] (NaN if empty)
+    p = np.asarray(prob, dtype=np.float64)[np.newaxis, :]
+    start = np.asarray(start)[:, np.newaxis]
+    n = np.asarray(count)[:, np.newaxis]
+
+    m = alphap + p * (1. - alphap - betap)
+    aleph = n * p + m
+    k = np.floor(np.clip(aleph, 1, np.maximum(n - 1, 1))).astype(np.int64)
+    gamma = np.clip(aleph - k, 0, 1)
+    lower = np.clip(start + k - 1, 0, max(len(x_sorted) - 1, 0))
+    upper = np.clip(start + np.minimum(k, n - 1), 0, max(len(x_sorted) - 1, 0))
+    if len(x_sorted) == 0:
+        return np.full((n.shape[0], p.shape[1]), np.nan)
+
+    result = (1 - gamma) * x_sorted[lower] + gamma * x_sorted[upper]
+    result[np.broadcast_to(n == 0, result.shape)] = np.nan
+
+    return result
+
+
+def binned_stats_table(df, x_str, y_str, ghms=None, group_str="ghm"):
+    """Binned statistics (as get_binned_stats) of y_str in bins of x_str for all groups in one pass"""
+
+    # groups that are not in ghms are ignored, ghms=None uses all groups
+    if ghms is None:
+        ghms = np.sort(df[group_str].dropna().unique())
+    groups = list(ghms)
+    n_groups = len(groups)
+    n_bins = 10
+
+    code = pd.Index(groups).get_indexer(df[group_str])
+    x = df[x_str].to_numpy(dtype=np.float64)
+    y = df[y_str].to_numpy(dtype=np.float64)
+
+    # sort once by (group, x), so that every group is a sorted segment (NaN values of x at the end)
+    use = code >= 0
+    order = np.lexsort((x[use], code[use]))
+    code = code[use][order]
+    x = x[use][order]
+    y = y[use][order]
+    count = np.bincount(code, minlength=n_groups)
+    count_valid = np.bincount(code[~np.isnan(x)], minlength=n_groups)
+    start = np.concatenate(([0], np.cumsum(count)[:-1]))
+
+    # equal-count bin edges of each group (bin_median includes NaN values, as in get_binned_stats)
+    bin_edges = grouped_mquantiles(x, start, count_valid, np.linspace(0, 1, n_bins + 1))
+    bin_median = grouped_mquantiles(x, start, count, np.linspace(0.05, 0.95, n_bins))
+
+    # bin number of each value within its group, by merging the values with the bin edges of their
+    # group (edges are sorted before equal values, as in np.searchsorted with side="right")
+    merged = np.lexsort((np.concatenate((np.zeros(bin_edges.size), np.ones(len(x)))),
+                         np.concatenate((bin_edges.ravel(), x)),
+                         np.concatenate((np.repeat(np.arange(n_groups), n_bins + 1), code))))
+    is_edge = merged < bin_edges.size
+    binnumber = np.empty(len(x), dtype=np.int64)
+    binnumber[merged[~is_edge] - bin_edges.size] = np.cumsum(is_edge)[~is_edge]
+    binnumber -= code * (n_bins + 1)
+    binnumber[x == bin_edges[code, -1]] -= 1
+
+    # statistics per (group, bin), with group code x bin code as combined key
+    inside = (binnumber >= 1) & (binnumber <= n_bins)
+    key = np.where(inside, code * n_bins + binnumber - 1, -1)
+    binned = binned_stats(key, y, np.arange(n_groups * n_bins + 1) - 0.5, quantiles=[.05, .25, .75, .95])
+
+    results_df = pd.DataFrame({"bin_lower_edge": bin_edges[:, :-1].ravel(),
+                               "bin_upper_edge": bin_edges[:, 1:].ravel(),
+                               "bin_median": bin_median.ravel(),
+                               "mean": binned["mean"],
+                               "std": binned["std"],
+                               "median": binned["median"],
+                               "05_perc": binned["quantiles"][0],
+                               "25_perc": binned["quantiles"][1],
+                               "75_perc": binned["quantiles"][2],
+                               "95_perc": binned["quantiles"][3],
+                               group_str: np.repeat(np.array(groups, dtype=object), n_bins)},
+                              index=np.tile(np.arange(n_bins), n_groups))
 
-    l = []
-    for g in ghms:
-        x = df.loc[df["ghm"]==g, x_str]
-        y = df.loc[df["ghm"]==g, y_str]
+    return results_df
 
-        # calculate binned statistics
-        bin_edges, \
-        mean_stat, std_stat, median_stat, \
-        p_05_stat, p_25_stat, p_75_stat, p_95_stat, \
-        asymmetric_error, bin_median = get_binned_stats(x, y)
-
-        results = pd.DataFrame()
-        results["bin_lower_edge"] = bin_edges[0:-1]
-        results["bin_upper_edge"] = bin_edges[1:]
-        results["bin_median"] = bin_median
-        results["mean"] = mean_stat.statistic
-        results["std"] = std_stat.statistic
-        results["median"] = median_stat.statistic
-        results["05_perc"] = p_05_stat.statistic
-        results["25_perc"] = p_25_stat.statistic
-        results["75_perc"] = p_75_stat.statistic
-        results["95_perc"] = p_95_stat.statistic
-        results["ghm"] = g
-
-        l.append(results)
-
-    results_df = pd.concat(l)
 
-    return results_df
+# result of a binned statistic, compatible with scipy.stats.binned_statistic
+BinnedStatisticResult = namedtuple("BinnedStatisticResult", ("statistic", "bin_edges", "binnumber"))
 
 
-def get_binned_stats(x, y):
+def get_binned_stats(x, y, streaming=False, chunk_size=10000000):
 
-    # calculate binned statistics
-    bin_edges = stats.mstats.mquantiles(x[~np.isnan(x)], np.linspace(0, 1, 11))
-    #bin_edges = np.linspace(-.5,10.5,12)
-    mean_stat = stats.binned_statistic(x, y, statistic=lambda y: np.nanmean(y), bins=bin_edges)
-    std_stat = stats.binned_statistic(x, y, statistic=lambda y: np.nanstd(y), bins=bin_edges)
-    median_stat = stats.binned_statistic(x, y, statistic=np.nanmedian, bins=bin_edges)
-    p_05_stat = stats.binned_statistic(x, y, statistic=lambda y: np.nanquantile(y, .05), bins=bin_edges)
-    p_25_stat = stats.binned_statistic(x, y, statistic=lambda y: np.nanquantile(y, .25), bins=bin_edges)
-    p_75_stat = stats.binned_statistic(x, y, statistic=lambda y: np.nanquantile(y, .75), bins=bin_edges)
-    p_95_stat = stats.binned_statistic(x, y, statistic=lambda y: np.nanquantile(y, .95), bins=bin_edges)
+    # streaming=True uses approximate quantile sketches, which are updated chunk by chunk with
+    # bounded memory (e.g. for all land pixels of a global raster, see functions/quantile_sketch.py)
+    if streaming:
+        bin_edges, binned, x_sketch = streaming_binned_stats(array_chunks(x, y, chunk_size), n_bins=10,
+                                                             quantiles=[.05, .25, .75, .95])
+        bin_median = x_sketch.quantile(np.linspace(0.05, 0.95, 10))
+    else:
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+
+        # calculate binned statistics
+        bin_edges = stats.mstats.mquantiles(x[~np.isnan(x)], np.linspace(0, 1, 11))
+        #bin_edges = np.linspace(-.5,10.5,12)
+        binned = binned_stats(x, y, bin_edges, quantiles=[.05, .25, .75, .95])
+        bin_median = stats.mstats.mquantiles(x, np.linspace(0.05, 0.95, 10))
+
+    mean_stat, std_stat, median_stat, p_05_stat, p_25_stat, p_75_stat, p_95_stat = \
+        [BinnedStatisticResult(statistic, bin_edges, binned["binnumber"]) for statistic in
+         [binned["mean"], binned["std"], binned["median"], *binned["quantiles"]]]
     asymmetric_error = [median_stat.statistic - p_25_stat.statistic, p_75_stat.statistic - median_stat.statistic]
-    bin_median = stats.mstats.mquantiles(x, np.linspace(0.05, 0.95, 10))
 
     return bin_edges, \
            mean_stat, std_stat, median_stat, \
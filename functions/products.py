@@ -0,0 +1,104 @@
+import numpy as np
+
+# This script contains a registry of the input products with their nodata values, valid ranges,
+# scale factors, offsets, and derived transforms, and a function that applies them to an array.
+# Valid ranges are given as (min, max), both inclusive, and refer to the raw (unscaled) values.
+
+
+def degrees_to_gradient(values):
+    # slope in degrees to gradient (tan of slope angle), in place
+    np.deg2rad(values, out=values)
+    np.tan(values, out=values)
+
+
+products = {
+    # CHELSA V2.1 (https://envicloud.wsl.ch/#/?prefix=chelsa%2Fchelsa_V2%2FGLOBAL%2F)
+    "P_CHELSA": {"nodata": 65535, "valid_range": (None, 50000), "scale": 0.1, "offset": 0.0,
+                 "transform": None, "unit": "mm/y"},
+    "PET_CHELSA": {"nodata": 65535, "valid_range": (None, 50000), "scale": 0.01 * 12, "offset": 0.0,
+                   "transform": None, "unit": "mm/y"},
+    "T_CHELSA": {"nodata": 65535, "valid_range": (None, 50000), "scale": 0.1, "offset": -273.15,
+                 "transform": None, "unit": "degC"},
+    # WorldClim 2.1 and Global Aridity Index and PET database
+    "P_WorldClim": {"nodata": -3.4028234663852886e+38, "valid_range": (0, None), "scale": 1.0, "offset": 0.0,
+                    "transform": None, "unit": "mm/y"},
+    "PET_WorldClim": {"nodata": -3.4028234663852886e+38, "valid_range": (0, None), "scale": 1.0, "offset": 0.0,
+                      "transform": None, "unit": "mm/y"},
+    "T_WorldClim": {"nodata": -3.4028234663852886e+38, "valid_range": (-100, None), "scale": 1.0, "offset": 0.0,
+                    "transform": None, "unit": "degC"},
+    # DEMs and their derivatives
+    "Elevation_MERIT": {"nodata": -9999, "valid_range": (-1000, None), "scale": 1.0, "offset": 0.0,
+                        "transform": None, "unit": "m"},
+    "Elevation_WorldClim": {"nodata": -32768, "valid_range": (-1000, None), "scale": 1.0, "offset": 0.0,
+                            "transform": None, "unit": "m"},
+    "Elevation_HydroSHEDS": {"nodata": 32767, "valid_range": (-1000, None), "scale": 1.0, "offset": 0.0,
+                             "transform": None, "unit": "m"},
+    "Slope_MERIT": {"nodata": -32768, "valid_range": (0, None), "scale": 0.01, "offset": 0.0,
+                    "transform": degrees_to_gradient, "unit": "-"},
+    # landform classes (1: mountains, 2: hills, 3: plateaus, 4: plains)
+    "WorldLandform": {"nodata": 0, "valid_range": (1, 4), "scale": 1.0, "offset": 0.0,
+                      "transform": None, "unit": "-"},
+    # upland/lowland classes (1: uplands, 2: lowlands, 3: water, 4: ice)
+    "Pelletier": {"nodata": 0, "valid_range": (1, 4), "scale": 1.0, "offset": 0.0,
+                  "transform": None, "unit": "-"},
+}
+
+
+def get_product(product_name):
+    # get registry entry of a product
+
+    if product_name not in products:
+        raise ValueError('Product ' + str(product_name) + ' not defined.')
+
+    return products[product_name]
+
+
+def get_valid_ranges(var_products):
+    # valid ranges for RasterStack.valid_mask, var_products maps a variable name to a product name
+
+    return {var: get_product(product_name)["valid_range"] for var, product_name in var_products.items()}
+
+
+def mask_and_scale(values, product_name, chunk_size=1 << 16):
+    '''Set nodata and out-of-range values to NaN and apply scale, offset, and transform in place'''
+
+    product = get_product(product_name)
+    nodata = product["nodata"]
+    lower, upper = product["valid_range"]
+    scale, offset, transform = product["scale"], product["offset"], product["transform"]
+
+    # work in place on writeable float arrays, integer arrays are converted (at least float32)
+    values = np.asarray(values)
+    dtype = np.result_type(values.dtype, np.float32)
+    if values.dtype != dtype or not values.flags.writeable or not values.flags.c_contiguous:
+        values = values.astype(dtype)
+    flat = values.reshape(-1)
+
+    # process the array in small chunks, so that the mask buffers stay in cache and only one
+    # pass over the data is needed (instead of one full-size mask per condition)
+    invalid = np.empty(min(chunk_size, flat.size), dtype=bool)
+    scratch = np.empty_like(invalid)
+    for start in range(0, flat.size, chunk_size):
+        chunk = flat[start:start + chunk_size]
+        inv = invalid[:len(chunk)]
+        tmp = scratch[:len(chunk)]
+        np.isfinite(chunk, out=inv)
+        np.logical_not(inv, out=inv)
+        if nodata is not None:
+            np.equal(chunk, nodata, out=tmp)
+            inv |= tmp
+        if lower is not None:
+            np.less(chunk, lower, out=tmp)
+            inv |= tmp
+        if upper is not None:
+            np.greater(chunk, upper, out=tmp)
+            inv |= tmp
+        if scale != 1:
+            np.multiply(chunk, scale, out=chunk)
+        if offset != 0:
+            np.add(chunk, offset, out=chunk)
+        if transform is not None:
+            transform(chunk)
+        chunk[inv] = np.nan
+
+    return values
@@ -0,0 +1,204 @@
+import numpy as np
+from functions.zonal_stats import chunk_windows
+from functions.products import mask_and_scale
+from functions.binned_stats import assign_bins
+
+# This script contains a mergeable approximate quantile sketch (KLL, Karnin et al., 2016) and
+# functions to calculate binned statistics (quantile bin edges and per-bin mean, std, and
+# percentiles) chunk by chunk with bounded memory, e.g. over all land pixels of a global raster.
+# Sketches of different chunks or worker processes can be merged.
+
+
+class QuantileSketch:
+    '''Approximate quantiles of a stream of values, the memory is bounded by about 3*k values'''
+
+    def __init__(self, k=200, seed=0):
+        self.k = k
+        self.n = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.levels = [np.empty(0)]  # items on level h have weight 2**h
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, h):
+        depth = len(self.levels) - 1 - h
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def _compress(self):
+        # sort full levels and promote every other item (random offset) to the next level
+        full = True
+        while full:
+            full = False
+            for h in range(len(self.levels)):
+                if len(self.levels[h]) > self._capacity(h):
+                    full = True
+                    if h + 1 == len(self.levels):
+                        self.levels.append(np.empty(0))
+                    level = np.sort(self.levels[h])
+                    odd = len(level) % 2
+                    offset = self._rng.integers(2)
+                    self.levels[h + 1] = np.concatenate((self.levels[h + 1], level[odd + offset::2]))
+                    self.levels[h] = level[:odd]
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if len(values) > 0:
+            self.n += len(values)
+            self.min = min(self.min, values.min())
+            self.max = max(self.max, values.max())
+            self.levels[0] = np.concatenate((self.levels[0], values))
+            self._compress()
+
+        return self
+
+    def merge(self, other):
+        if other.k != self.k:
+            raise ValueError('Only sketches with the same k can be merged.')
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for h, level in enumerate(other.levels):
+            self.levels[h] = np.concatenate((self.levels[h], level))
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+
+        return self
+
+    def quantile(self, q):
+        '''Approximate quantiles q (exact for q=0 and q=1), NaN if the sketch is empty'''
+
+        q = np.asarray(q, dtype=np.float64)
+        if self.n == 0:
+            return np.full(q.shape, np.nan)
+
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2.0 ** h) for h, level in enumerate(self.levels)])
+        order = np.argsort(items)
+        items = items[order]
+        weights = weights[order]
+
+        # interpolate between the centres of the item weights, anchored at min and max
+        cdf = (np.cumsum(weights) - weights / 2) / weights.sum()
+        cdf = np.concatenate(([0], cdf, [1]))
+        items = np.concatenate(([self.min], items, [self.max]))
+
+        return np.interp(q, cdf, items)
+
+
+class BinnedSketch:
+    '''Count, mean, std, and approximate quantiles of y in bins of x, mergeable across chunks and workers'''
+
+    def __init__(self, bin_edges, k=200, seed=0):
+        self.bin_edges = np.asarray(bin_edges, dtype=np.float64)
+        n_bins = len(self.bin_edges) - 1
+        self.count = np.zeros(n_bins)
+        self.mean = np.zeros(n_bins)
+        self.m2 = np.zeros(n_bins)  # sum of squared deviations from the mean
+        self.sketches = [QuantileSketch(k, seed + i) for i in range(n_bins)]
+
+    def _merge_moments(self, count, mean, m2):
+        # combine counts, means, and squared deviations of two sets (Chan et al., 1979)
+        total = self.count + count
+        with np.errstate(invalid="ignore", divide="ignore"):
+            delta = mean - self.mean
+            new_mean = np.where(total > 0, self.mean + delta * count / total, 0)
+            new_m2 = np.where(total > 0, self.m2 + m2 + delta ** 2 * self.count * count / total, 0)
+        self.count, self.mean, self.m2 = total, new_mean, new_m2
+
+    def update(self, x, y):
+        x = np.asarray(x, dtype=np.float64).ravel()
+        y = np.asarray(y, dtype=np.float64).ravel()
+        n_bins = len(self.sketches)
+
+        binnumber = assign_bins(x, self.bin_edges)
+        use = (binnumber >= 1) & (binnumber <= n_bins) & ~np.isnan(y)
+        b = binnumber[use] - 1
+        v = y[use]
+
+        count = np.bincount(b, minlength=n_bins).astype(np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(count > 0, np.bincount(b, weights=v, minlength=n_bins) / count, 0)
+        m2 = np.bincount(b, weights=(v - mean[b]) ** 2, minlength=n_bins)
+        self._merge_moments(count, mean, m2)
+
+        order = np.argsort(b, kind="stable")
+        start = np.concatenate(([0], np.cumsum(count.astype(np.int64))))
+        v = v[order]
+        for i in np.flatnonzero(count):
+            self.sketches[i].update(v[start[i]:start[i + 1]])
+
+        return self
+
+    def merge(self, other):
+        if not np.array_equal(self.bin_edges, other.bin_edges):
+            raise ValueError('Only sketches with the same bin edges can be merged.')
+        self._merge_moments(other.count, other.mean, other.m2)
+        for sketch, other_sketch in zip(self.sketches, other.sketches):
+            sketch.merge(other_sketch)
+
+        return self
+
+    def results(self, quantiles=()):
+        '''Statistics per bin, with the same keys as binned_stats (see functions/binned_stats.py)'''
+
+        full = self.count > 0
+        mean = np.where(full, self.mean, np.nan)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            std = np.where(full, np.sqrt(self.m2 / self.count), np.nan)
+        median = np.array([sketch.quantile(0.5) for sketch in self.sketches])
+        quantile_stats = np.array([sketch.quantile(quantiles) for sketch in self.sketches]).T
+        quantile_stats = quantile_stats.reshape(len(quantiles), len(self.sketches))
+
+        return {"count": self.count.astype(np.int64), "mean": mean, "std": std, "median": median,
+                "quantiles": quantile_stats, "binnumber": None}
+
+
+def array_chunks(x, y, chunk_size=10000000):
+    # function that returns an iterator over chunks of two (possibly memory-mapped) arrays
+    x = np.asarray(x)
+    y = np.asarray(y)
+
+    def chunks():
+        for i in range(0, len(x), chunk_size):
+            yield np.asarray(x[i:i + chunk_size]), np.asarray(y[i:i + chunk_size])
+
+    return chunks
+
+
+def raster_chunks(stack, x_name, y_name, valid_range=None, var_products=None, rows_per_chunk=None):
+    # function that returns an iterator over the valid cells of two layers of a RasterStack, window by window
+    if var_products is None:
+        var_products = {}
+
+    def chunks():
+        for window in chunk_windows(stack, rows_per_chunk):
+            data = stack.read(window)
+            mask = stack.valid_mask(data, valid_range)
+            values = []
+            for name in [x_name, y_name]:
+                v = data[stack.names.index(name)][mask]
+                if name in var_products:
+                    v = mask_and_scale(v, var_products[name])
+                values.append(v)
+            yield values[0], values[1]
+
+    return chunks
+
+
+def streaming_binned_stats(chunks, n_bins=10, quantiles=(.05, .25, .5, .75, .95), k=200):
+    '''Equal-count bin edges of x and statistics of y per bin, calculated chunk by chunk'''
+
+    # chunks is a function that returns an iterator over (x, y) chunks, since two passes are needed:
+    # the first pass sketches x to get the bin edges, the second pass sketches y per bin
+    x_sketch = QuantileSketch(k)
+    for x, y in chunks():
+        x_sketch.update(x)
+    bin_edges = x_sketch.quantile(np.linspace(0, 1, n_bins + 1))
+
+    binned_sketch = BinnedSketch(bin_edges, k)
+    for x, y in chunks():
+        binned_sketch.update(x, y)
+
+    return bin_edges, binned_sketch.results(quantiles), x_sketch
@@ -0,0 +1,270 @@
+import numpy as np
+import rasterio as rio
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+
+# This script contains a helper class that reads several aligned rasters (e.g. the *_30s.tif
+# files created by resample_rasters.py) as one (layer, row, col) array. Since all layers share
+# one grid, cells are joined by their array index and no merge on coordinates is needed. It also
+# contains functions to check that rasters are aligned and to fix sub-pixel shifts of their grids
+# (which would otherwise break the join by index), to sample all layers at many points (e.g.
+# station locations) at once, and to read rasters at a coarser resolution from their overviews
+# (e.g. the COGs created by resample_rasters.py).
+
+
+class RasterStack:
+    '''Collection of rasters that share one grid (same shape, transform, and CRS)'''
+
+    def __init__(self, path_list, var_list, atol=1e-9):
+
+        if len(path_list) != len(var_list):
+            raise ValueError('path_list and var_list need to have the same length.')
+
+        self.paths = list(path_list)
+        self.names = list(var_list)
+
+        # check that all layers share the grid of the first layer (see check_alignment)
+        profiles = [read_grid(path) for path in self.paths]
+        mismatches = grid_mismatches(self.names, profiles, atol)
+        if mismatches:
+            message = 'Rasters are not aligned:\n' + '\n'.join(m["message"] for m in mismatches)
+            if any(m["fixable"] for m in mismatches):
+                message += '\nSub-pixel shifts can be fixed with fix_alignment (see functions/raster_stack.py).'
+            raise ValueError(message)
+
+        ref = profiles[0]
+        self.height, self.width = ref["shape"]
+        self.transform = ref["transform"]
+        self.crs = ref["crs"]
+        self.nodata = [profile["nodata"] for profile in profiles]
+        self.dtypes = [profile["dtype"] for profile in profiles]
+
+    def __len__(self):
+        return len(self.paths)
+
+    @property
+    def shape(self):
+        return len(self.paths), self.height, self.width
+
+    def read(self, window=None, dtype=np.float32, resolution=None):
+        '''Read all layers (optionally only a window) into one (layer, row, col) array'''
+
+        # resolution is the cell size of the result (e.g. 0.1 degrees), which is read from the
+        # coarsest overview level that is fine enough (see read_decimated), None is full resolution
+        if window is None:
+            window = Window(0, 0, self.width, self.height)
+        height, width = int(window.height), int(window.width)
+        if resolution is not None:
+            factor = max(1, resolution / abs(self.transform.a))
+            height, width = max(1, int(np.ceil(height / factor))), max(1, int(np.ceil(width / factor)))
+
+        data = np.empty((len(self.paths), height, width), dtype=dtype)
+        for i, path in enumerate(self.paths):
+            if resolution is None:
+                with rio.open(path) as src:
+                    src.read(1, window=window, out=data[i])
+            else:
+                data[i] = read_decimated(path, window, (height, width))
+
+        return data
+
+    def valid_mask(self, data, valid_range=None):
+        '''Joint mask of cells that are finite, not nodata, and within valid_range in every layer'''
+
+        # valid_range maps a layer name to (min, max), both inclusive, None means no limit
+        mask = np.ones(data.shape[1:], dtype=bool)
+        for i in range(len(self.names)):
+            mask &= self.layer_mask(data, i, valid_range)
+
+        return mask
+
+    def layer_mask(self, data, i, valid_range=None):
+        '''Mask of cells that are finite, not nodata, and within valid_range in layer i'''
+
+        if valid_range is None:
+            valid_range = {}
+        layer = data[i]
+        mask = np.isfinite(layer)
+        if self.nodata[i] is not None and not np.isnan(self.nodata[i]):
+            mask &= layer != np.asarray(self.nodata[i]).astype(layer.dtype)
+        lower, upper = valid_range.get(self.names[i], (None, None))
+        if lower is not None:
+            mask &= layer >= lower
+        if upper is not None:
+            mask &= layer <= upper
+
+        return mask
+
+    def xy(self, rows, cols, window=None):
+        '''Coordinates (lon, lat) of the centres of the given cells'''
+
+        if window is not None:
+            rows = rows + int(window.row_off)
+            cols = cols + int(window.col_off)
+        a = self.transform
+        lon = a.c + (cols + 0.5) * a.a + (rows + 0.5) * a.b
+        lat = a.f + (cols + 0.5) * a.d + (rows + 0.5) * a.e
+
+        return lon, lat
+
+    def to_columns(self, data, mask, window=None, coords=True):
+        '''Flatten all valid cells into a dict of 1-D arrays (one per layer, plus coordinates)'''
+
+        # coords=True adds lon and lat (float64), coords="rowcol" adds row and col in the grid of the
+        # stack as small unsigned integers (lon and lat can be calculated with xy when needed)
+        rows, cols = np.nonzero(mask)
+        columns = {}
+        if coords == "rowcol":
+            index_dtype = np.min_scalar_type(max(self.height, self.width))
+            columns["row"] = (rows + (0 if window is None else int(window.row_off))).astype(index_dtype)
+            columns["col"] = (cols + (0 if window is None else int(window.col_off))).astype(index_dtype)
+        elif coords:
+            columns["lon"], columns["lat"] = self.xy(rows, cols, window)
+        for i, name in enumerate(self.names):
+            columns[name] = data[i][rows, cols]
+
+        return columns
+
+
+def read_grid(path):
+    '''Shape, transform, CRS, nodata value, and data type of the first band of a raster'''
+
+    with rio.open(path) as src:
+        return {"shape": (src.height, src.width), "transform": src.transform,
+                "crs": src.crs, "nodata": src.nodata, "dtype": src.dtypes[0]}
+
+
+def grid_mismatches(names, profiles, atol=1e-9, max_shift=0.5):
+    '''Differences between the grid of each layer and the grid of the first layer'''
+
+    # returns one dict per mismatch with the layer name, a message, the offset of the grid in
+    # (col, row) pixels, and whether the mismatch can be fixed by rewriting the transform (same
+    # shape, CRS, and cell size, origin shifted by less than max_shift pixels), see fix_alignment
+    ref = profiles[0]
+    a = ref["transform"]
+    mismatches = []
+    for name, profile in zip(names, profiles):
+        if profile["shape"] != ref["shape"]:
+            mismatches.append({"name": name, "message": name + ": shape " + str(profile["shape"]) + " != " +
+                               str(ref["shape"]), "shift": None, "fixable": False})
+        if profile["crs"] != ref["crs"]:
+            mismatches.append({"name": name, "message": name + ": CRS " + str(profile["crs"]) + " != " +
+                               str(ref["crs"]), "shift": None, "fixable": False})
+        b = profile["transform"]
+        if profile["shape"] != ref["shape"] or b.almost_equals(a, precision=atol):
+            continue
+
+        # shift of the origin in pixels and accumulated drift of the cell size over the whole grid
+        shift = ((b.c - a.c) / abs(a.a), (b.f - a.f) / abs(a.e))
+        drift = max(abs(b.a - a.a) * ref["shape"][1] / abs(a.a), abs(b.e - a.e) * ref["shape"][0] / abs(a.e),
+                    abs(b.b - a.b) * ref["shape"][0] / abs(a.a), abs(b.d - a.d) * ref["shape"][1] / abs(a.e))
+        fixable = profile["crs"] == ref["crs"] and max(abs(shift[0]), abs(shift[1])) + drift < max_shift
+        mismatches.append({"name": name, "message": name + ": transform differs from " + names[0] +
+                           " (origin shifted by %.3g, %.3g pixels, cell size drift %.3g pixels)" % (*shift, drift),
+                           "shift": shift, "fixable": fixable})
+
+    return mismatches
+
+
+def check_alignment(path_list, var_list, atol=1e-9, max_shift=0.5):
+    '''Compare shape, transform, and CRS of all rasters with the first raster and report mismatches'''
+
+    mismatches = grid_mismatches(var_list, [read_grid(path) for path in path_list], atol, max_shift)
+    for mismatch in mismatches:
+        print(mismatch["message"] + (" (fixable)" if mismatch["fixable"] else ""))
+
+    return mismatches
+
+
+def snap_to_grid(path, transform):
+    '''Replace the transform of a raster (in place, the values are not resampled)'''
+
+    # not for COGs, whose layout is broken by rewriting them in place
+    with rio.open(path, "r+") as dst:
+        dst.transform = transform
+
+
+def fix_alignment(path_list, var_list, atol=1e-9, max_shift=0.5):
+    '''Snap rasters whose grid is shifted by less than max_shift pixels to the grid of the first raster'''
+
+    # only the transform is rewritten, rasters with other mismatches (shape, CRS, larger shifts)
+    # need to be resampled (see resample_rasters.py) and raise an error
+    mismatches = check_alignment(path_list, var_list, atol, max_shift)
+    errors = [mismatch["message"] for mismatch in mismatches if not mismatch["fixable"]]
+    if errors:
+        raise ValueError('Rasters cannot be aligned without resampling:\n' + '\n'.join(errors))
+
+    transform = read_grid(path_list[0])["transform"]
+    for mismatch in mismatches:
+        snap_to_grid(path_list[list(var_list).index(mismatch["name"])], transform)
+
+    return [mismatch["name"] for mismatch in mismatches]
+
+
+def overview_level(src, factor):
+    '''Index of the coarsest overview of src that is not coarser than factor (None for full resolution)'''
+
+    level = None
+    for i, overview_factor in enumerate(src.overviews(1)):
+        if overview_factor <= factor:
+            level = i
+
+    return level
+
+
+def read_decimated(path, window, out_shape, resampling=Resampling.nearest, masked=False):
+    '''Read a window (of the full resolution grid) of a raster into out_shape, from its overviews if possible'''
+
+    # the overview level is chosen from the ratio of the window size and out_shape, the window
+    # is then read from that level (and resampled to out_shape)
+    factor = max(1, min(window.width / out_shape[1], window.height / out_shape[0]))
+    with rio.open(path) as src:
+        level = overview_level(src, factor)
+        if level is None:
+            return src.read(1, window=window, out_shape=out_shape, resampling=resampling, masked=masked)
+        width, height = src.width, src.height
+
+    with rio.open(path, overview_level=level) as src:
+        scale_x, scale_y = src.width / width, src.height / height
+        window = Window(window.col_off * scale_x, window.row_off * scale_y,
+                        window.width * scale_x, window.height * scale_y)
+        return src.read(1, window=window, out_shape=out_shape, resampling=resampling, masked=masked)
+
+
+def sample_points(stack, lon, lat, dtype=np.float64, min_rows=256):
+    '''Values of all layers at the given points as (point, layer) array, NaN outside of the grid'''
+
+    # convert all coordinates to row/col indices at once
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    cols, rows = ~stack.transform * (lon, lat)
+    rows = np.floor(rows).astype(np.int64)
+    cols = np.floor(cols).astype(np.int64)
+    inside = np.flatnonzero((rows >= 0) & (rows < stack.height) & (cols >= 0) & (cols < stack.width))
+    rows, cols = rows[inside], cols[inside]
+
+    values = np.full((len(lon), len(stack)), np.nan, dtype=dtype)
+    for i, path in enumerate(stack.paths):
+        with rio.open(path) as src:
+            block_height, block_width = src.block_shapes[0]
+            # strips (blocks as wide as the raster) are grouped to bands of at least min_rows rows
+            if block_width >= stack.width:
+                block_height = int(np.ceil(min_rows / block_height)) * block_height
+
+            # group points by block and read every needed block once
+            block_row = rows // block_height
+            block_col = cols // block_width
+            key = block_row * (stack.width // block_width + 1) + block_col
+            order = np.argsort(key, kind="stable")
+            unique_keys, starts = np.unique(key[order], return_index=True)
+            ends = np.append(starts[1:], len(order))
+            for start, end in zip(starts, ends):
+                ind = order[start:end]
+                row_off = block_row[ind[0]] * block_height
+                col_off = block_col[ind[0]] * block_width
+                window = Window(col_off, row_off, min(block_width, stack.width - col_off),
+                                min(block_height, stack.height - row_off))
+                block = src.read(1, window=window)
+                values[inside[ind], i] = block[rows[ind] - row_off, cols[ind] - col_off]
+
+    return values
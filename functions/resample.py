@@ -0,0 +1,166 @@
+import os
+import time
+import json
+import hashlib
+import functools
+from osgeo import gdal
+from functions.parallel import map_windows
+from functions.file_cache import file_fingerprint
+try:
+    import resource  # not available on Windows
+except ImportError:
+    resource = None
+
+# This script contains a resumable pipeline to resample and align rasters with gdal.Warp (e.g. to
+# global 30 arc-second grids, see resample_rasters.py). Files are warped in parallel worker
+# processes with a limited number of GDAL threads and warp memory each, and are written as tiled,
+# compressed Cloud-Optimized GeoTIFFs (COG) with internal overviews, so that windows and coarser
+# resolutions can be read without decoding whole strips (see read_decimated in
+# functions/raster_stack.py), or as tiled GeoTIFFs without overviews. A manifest (JSON) records
+# the checksum of every source, the warp parameters, wall time, and peak memory of every output.
+# Outputs whose source and parameters have not changed are skipped, so that an interrupted or
+# extended run only warps what is missing.
+
+
+def file_checksum(path, chunk_size=64 * 1024 ** 2):
+    '''SHA-256 of a file, read chunk by chunk'''
+
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(functools.partial(f.read, chunk_size), b""):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+
+def source_checksum(path, entry=None):
+    '''Checksum, size, and modification time of a source file (checksum reused from entry if unchanged)'''
+
+    # hashing global rasters takes a while, so the checksum of a manifest entry is reused as long
+    # as size and modification time of the file are the same
+    abspath, mtime_ns, size = file_fingerprint(path)
+    source = {"path": abspath, "size": size, "mtime_ns": mtime_ns}
+    if entry is not None and all(entry["source"].get(key) == source[key] for key in source):
+        source["sha256"] = entry["source"]["sha256"]
+    else:
+        source["sha256"] = file_checksum(path)
+
+    return source
+
+
+def load_manifest(manifest_path):
+    '''Manifest entries by output name (empty if there is no manifest yet)'''
+
+    if not os.path.isfile(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, manifest_path):
+    '''Write the manifest atomically (a temporary file replaces the old manifest)'''
+
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def creation_options(dtype_name, driver="COG", block_size=512, compress="DEFLATE", predictor=None,
+                     overview_resampling="AVERAGE", threads=1):
+    '''Creation options for tiled, compressed output (COG or GTiff) of a GDAL data type'''
+
+    # predictor None uses the floating point predictor for float rasters and horizontal differencing
+    # for integer rasters, overview_resampling should be NEAREST or MODE for class layers (e.g. landforms)
+    if predictor is None:
+        predictor = 3 if dtype_name.startswith("Float") else 2
+    if driver == "COG":
+        # the COG driver names the predictors instead of numbering them
+        predictor_names = {1: "NO", 2: "STANDARD", 3: "FLOATING_POINT"}
+        return ["BLOCKSIZE=" + str(block_size), "COMPRESS=" + compress,
+                "PREDICTOR=" + predictor_names[predictor], "OVERVIEWS=IGNORE_EXISTING",
+                "OVERVIEW_RESAMPLING=" + overview_resampling, "BIGTIFF=IF_SAFER",
+                "NUM_THREADS=" + str(threads)]
+    elif driver == "GTiff":
+        return ["TILED=YES", "BLOCKXSIZE=" + str(block_size), "BLOCKYSIZE=" + str(block_size),
+                "COMPRESS=" + compress, "PREDICTOR=" + str(predictor), "BIGTIFF=IF_SAFER",
+                "NUM_THREADS=" + str(threads)]
+    else:
+        raise ValueError('Driver ' + str(driver) + ' not supported.')
+
+
+def warp_raster(task, threads=1, memory_limit=512, cache_size=256):
+    '''Warp one source to one output with gdal.Warp, returns wall time and peak memory'''
+
+    # task is (source path, output path, parameters), parameters are the keyword arguments of
+    # gdal.Warp (e.g. outputBounds, xRes, yRes, resampleAlg, dstSRS) plus the output options of
+    # creation_options (driver, block_size, compress, predictor, overview_resampling),
+    # memory_limit (warp memory) and cache_size (GDAL block cache) are in MB per worker
+    src_path, dst_path, parameters = task
+    parameters = dict(parameters)
+    output_options = {key: parameters.pop(key) for key in
+                      ("driver", "block_size", "compress", "predictor", "overview_resampling") if key in parameters}
+
+    gdal.UseExceptions()
+    gdal.SetConfigOption("GDAL_CACHEMAX", str(cache_size))
+    gdal.SetConfigOption("GDAL_NUM_THREADS", str(threads))
+
+    start = time.perf_counter()
+    ds = gdal.Open(src_path)
+    dtype_name = gdal.GetDataTypeName(ds.GetRasterBand(1).DataType)
+
+    # write to a temporary file first, so that an interrupted warp never leaves a complete-looking output
+    tmp_path = dst_path + ".tmp.tif"
+    gdal.Warp(tmp_path, ds, format=output_options.get("driver", "COG"), multithread=threads > 1,
+              warpMemoryLimit=memory_limit, warpOptions=["NUM_THREADS=" + str(threads)],
+              creationOptions=creation_options(dtype_name, threads=threads, **output_options), **parameters)
+    ds = None
+    os.replace(tmp_path, dst_path)
+    wall_time = time.perf_counter() - start
+
+    # peak resident memory of the worker process, which only warps this file (see resample_rasters)
+    peak_memory = None
+    if resource is not None:
+        peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # kB on Linux
+
+    return {"wall_time_s": wall_time, "peak_memory_mb": peak_memory}
+
+
+def resample_rasters(sources, parameters, manifest_path, n_workers=1, threads=1, memory_limit=512,
+                     cache_size=256):
+    '''Warp all sources whose output is missing or outdated, in parallel, and record them in the manifest'''
+
+    # sources maps an output name to (source path, output path) or (source path, output path,
+    # parameters that differ from the common parameters, e.g. {"overview_resampling": "MODE"} for class
+    # layers), see warp_raster, the manifest is updated after every output, so that a run can be resumed;
+    # every file is warped in a new worker process, so that its peak memory is measured on its own
+    # (the calling script needs an if __name__ == "__main__" guard)
+    manifest = load_manifest(manifest_path)
+
+    names = []
+    tasks = []
+    checksums = {}
+    for name, source in sources.items():
+        src_path, dst_path = source[0], source[1]
+        source_parameters = dict(parameters, **(source[2] if len(source) > 2 else {}))
+        source_parameters = json.loads(json.dumps(source_parameters))  # same types as in the manifest (e.g. lists)
+        entry = manifest.get(name)
+        checksums[name] = source_checksum(src_path, entry)
+        up_to_date = entry is not None and os.path.isfile(dst_path) and \
+            entry["source"]["sha256"] == checksums[name]["sha256"] and entry["parameters"] == source_parameters
+        if up_to_date:
+            print(name + ": up to date")
+            continue
+        names.append(name)
+        tasks.append((src_path, dst_path, source_parameters))
+
+    function = functools.partial(warp_raster, threads=threads, memory_limit=memory_limit, cache_size=cache_size)
+    for i, record in map_windows(function, tasks, n_workers, fresh_process=True):
+        name = names[i]
+        manifest[name] = {"source": checksums[name], "output": os.path.abspath(tasks[i][1]),
+                          "parameters": tasks[i][2], **record,
+                          "finished": time.strftime("%Y-%m-%d %H:%M:%S")}
+        save_manifest(manifest, manifest_path)
+        print(name + ": " + str(round(record["wall_time_s"], 1)) + " s")
+
+    return manifest
@@ -0,0 +1,122 @@
+import numpy as np
+import rasterio as rio
+from rasterio.windows import Window
+from shapely.geometry import LineString, Polygon
+from functions.cell_area import a_km, f
+
+# This script contains functions to sample several rasters along a swath. The sample points
+# (lines perpendicular to a baseline) are calculated once and every raster is only read within
+# the bounding box of the swath, so that the rasters do not need to share a grid and the global
+# files are never read as a whole. The values are returned as (raster, along, across) array.
+
+
+def interpolate_line(line, distance):
+    '''Points at the given distances along a line and the unit direction of the line at these points'''
+
+    # same as line.interpolate(d) for every distance d, but for all distances at once
+    coords = np.asarray(line.coords)[:, :2]
+    segment_length = np.hypot(*np.diff(coords, axis=0).T)
+    coords = coords[np.append(True, segment_length > 0)]  # drop repeated vertices
+    segment_length = segment_length[segment_length > 0]
+    vertex_distance = np.concatenate(([0], np.cumsum(segment_length)))
+
+    distance = np.asarray(distance, dtype=np.float64)
+    px = np.interp(distance, vertex_distance, coords[:, 0])
+    py = np.interp(distance, vertex_distance, coords[:, 1])
+
+    # direction of the segment of each point
+    segment = np.clip(np.searchsorted(vertex_distance, distance, side="right") - 1, 0, len(segment_length) - 1)
+    dx, dy = np.diff(coords, axis=0).T / segment_length
+
+    return px, py, dx[segment], dy[segment]
+
+
+def along_track_distance(lon, lat):
+    '''Distance in km from the first point along a path of lon/lat points (WGS84), along the first axis'''
+
+    # lon and lat can have any shape, e.g. (along, across) for the distance along every line of a swath;
+    # the path is split into short segments, whose length is calculated with the radii of curvature
+    # of the ellipsoid at their mean latitude
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    d_lon = np.deg2rad((np.diff(lon, axis=0) + 180) % 360 - 180)
+    d_lat = np.deg2rad(np.diff(lat, axis=0))
+    lat_mid = np.deg2rad((lat[1:] + lat[:-1]) / 2)
+
+    e2 = f * (2 - f)
+    w = np.sqrt(1 - e2 * np.sin(lat_mid) ** 2)
+    n = a_km / w  # prime vertical radius of curvature
+    m = a_km * (1 - e2) / w ** 3  # meridional radius of curvature
+    segment_length = np.hypot(n * np.cos(lat_mid) * d_lon, m * d_lat)
+
+    return np.concatenate((np.zeros_like(segment_length[:1]), np.cumsum(segment_length, axis=0)), axis=0)
+
+
+def line_distance_km(line, distance, max_step=0.01):
+    '''Distance in km along a lon/lat line to the points at the given (planar) distances along it'''
+
+    # the line is densified to segments of at most max_step degrees (keeping all vertices), so that
+    # curved and long lines in any direction are measured along the ellipsoid
+    distance = np.asarray(distance, dtype=np.float64)
+    vertex_distance = np.cumsum(np.hypot(*np.diff(np.asarray(line.coords)[:, :2], axis=0).T))
+    dense = np.unique(np.concatenate((distance.ravel(), np.arange(0, line.length, max_step), [0], vertex_distance)))
+    px, py, _, _ = interpolate_line(line, dense)
+
+    return np.interp(distance, dense, along_track_distance(px, py))
+
+
+def swath_coordinates(line, width, line_stepsize, cross_stepsize):
+    '''Distance along the baseline and (along, across) coordinates of the sample points of a swath'''
+
+    # line is a shapely LineString (e.g. from functions/create_shapefiles.py), width is the full swath width
+    distance = np.arange(0, line.length, line_stepsize)
+    px, py, dx, dy = interpolate_line(line, distance)
+    nx, ny = -dy, dx  # unit normal
+
+    # points across the baseline, centred on it
+    offset = np.linspace(-width / 2, width / 2, int(round(width / cross_stepsize)) + 1)
+    x = px[:, np.newaxis] + offset[np.newaxis, :] * nx[:, np.newaxis]
+    y = py[:, np.newaxis] + offset[np.newaxis, :] * ny[:, np.newaxis]
+
+    return distance, x, y
+
+
+def sample_swath(paths, x, y, dtype=np.float64):
+    '''Values of several rasters at the swath coordinates as (raster, along, across) array'''
+
+    # nearest cell of every raster, raw values (no nodata handling), NaN outside of a raster
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    data = np.full((len(paths),) + x.shape, np.nan, dtype=dtype)
+
+    for i, path in enumerate(paths):
+        with rio.open(path) as src:
+            cols, rows = ~src.transform * (x, y)
+            rows = np.floor(rows).astype(np.int64)
+            cols = np.floor(cols).astype(np.int64)
+            inside = (rows >= 0) & (rows < src.height) & (cols >= 0) & (cols < src.width)
+            if not inside.any():
+                continue
+
+            # read the bounding box of the swath only
+            row_off, col_off = rows[inside].min(), cols[inside].min()
+            window = Window(col_off, row_off, cols[inside].max() - col_off + 1, rows[inside].max() - row_off + 1)
+            block = src.read(1, window=window)
+            data[i][inside] = block[rows[inside] - row_off, cols[inside] - col_off]
+
+    return data
+
+
+def swath_polylines(x, y):
+    '''Lines across the swath (one per point along the baseline)'''
+
+    return [LineString(np.column_stack((xi, yi))) for xi, yi in zip(x, y)]
+
+
+def swath_polygon(x, y):
+    '''Outline of the swath'''
+
+    outline_x = np.concatenate((x[:, 0], x[-1, :], x[::-1, -1], x[0, ::-1]))
+    outline_y = np.concatenate((y[:, 0], y[-1, :], y[::-1, -1], y[0, ::-1]))
+
+    return Polygon(np.column_stack((outline_x, outline_y)))
@@ -0,0 +1,81 @@
+import os
+import time
+import json
+import hashlib
+import numpy as np
+from functions.file_cache import file_fingerprint, atomic_savez, load_npz_or_none
+from functions.sample_swath import swath_coordinates, sample_swath
+
+# This script contains a persistent cache of sampled swaths (e.g. under results/<region>/cache/).
+# Every swath is stored as one NPZ file, whose name is a hash of everything the sampled values
+# depend on: the baseline geometry, the swath dimensions, and the path, modification time, and
+# size of every raster. Changed inputs therefore never hit an old entry. Entries are evicted by
+# age and, if the cache grows too large, least recently used first. Swath entries are named
+# swath_<hash>.npz, so that other files in the same directory (e.g. the background maps of
+# functions/background_map.py) are neither evicted nor counted.
+
+
+def swath_cache_key(line, paths, width, line_stepsize, cross_stepsize):
+    '''Hash of the baseline, the swath dimensions, and the raster files'''
+
+    rasters = [file_fingerprint(path) for path in paths]
+    content = {"line": np.asarray(line.coords, dtype=np.float64).tolist(),
+               "width": float(width), "line_stepsize": float(line_stepsize),
+               "cross_stepsize": float(cross_stepsize), "rasters": rasters}
+
+    return hashlib.sha256(json.dumps(content).encode()).hexdigest()
+
+
+def evict_swath_cache(cache_dir, max_size=None, max_age=None):
+    '''Remove swath entries older than max_age (seconds) and the least recently used ones above max_size (bytes)'''
+
+    entries = []
+    for file in os.listdir(cache_dir):
+        if file.startswith("swath_") and file.endswith(".npz"):
+            try:
+                stat = os.stat(os.path.join(cache_dir, file))
+            except FileNotFoundError:  # removed by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, os.path.join(cache_dir, file)))
+    entries.sort()
+
+    now = time.time()
+    total_size = sum(size for _, size, _ in entries)
+    for mtime, size, path in entries:
+        too_old = max_age is not None and now - mtime > max_age
+        too_large = max_size is not None and total_size > max_size
+        if not (too_old or too_large):
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+
+
+def cached_sample_swath(line, paths, width, line_stepsize, cross_stepsize, cache_dir=None,
+                        max_size=None, max_age=None):
+    '''Distance, coordinates, and (raster, along, across) values of a swath, loaded from cache_dir if possible'''
+
+    distance, swath_x, swath_y = swath_coordinates(line, width, line_stepsize, cross_stepsize)
+    if cache_dir is None:
+        return distance, swath_x, swath_y, sample_swath(paths, swath_x, swath_y)
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, "swath_" + swath_cache_key(line, paths, width, line_stepsize, cross_stepsize) + ".npz")
+
+    # entries can be missing, or removed or broken in the meantime
+    cached = load_npz_or_none(path)
+    if cached is not None and "swath_data" in cached:
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:  # removed by another process
+            pass
+        return distance, swath_x, swath_y, cached["swath_data"]
+
+    swath_data = sample_swath(paths, swath_x, swath_y)
+    atomic_savez(path, swath_data=swath_data)
+    evict_swath_cache(cache_dir, max_size, max_age)
+
+    return distance, swath_x, swath_y, swath_data
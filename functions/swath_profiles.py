@@ -0,0 +1,52 @@
+import numpy as np
+from functions.elevation_bands import elevation_bands
+from functions.get_swath_data import get_swath_data
+from functions.products import mask_and_scale
+from functions.sample_swath import swath_polygon
+from functions.swath_cache import cached_sample_swath
+
+# This script contains a function that extracts one swath and calculates its elevation profiles
+# of aridity (PET/P), PET, and P. It only returns a small result record, so that many swaths can
+# be processed in parallel worker processes (see map_windows in functions/parallel.py) and
+# plotted afterwards. Lapse rates of all swaths are fitted at once from the stacked profiles
+# (see functions/lapse_rates.py).
+
+
+def swath_profile(line_shape, paths, width, line_stepsize, cross_stepsize,
+                  var_products=("P_CHELSA", "PET_CHELSA", "T_CHELSA"), n_bins=10, band_mode="width",
+                  cache_dir=None, cache_max_size=None, cache_max_age=None):
+    '''Swath outline and binned aridity, PET, and P over elevation of one swath'''
+
+    # paths are the DEM, P, PET, and T rasters, var_products are the products of P, PET, and T,
+    # sampled swaths are reused from cache_dir if given (see functions/swath_cache.py), elevation bands
+    # have a fixed width or equal counts (band_mode, see functions/elevation_bands.py)
+    distance, swath_x, swath_y, swath_data = \
+        cached_sample_swath(line_shape, paths, width, line_stepsize, cross_stepsize,
+                            cache_dir, cache_max_size, cache_max_age)
+    px, py = swath_polygon(swath_x, swath_y).exterior.xy
+
+    dist, dem_swath, pr_swath, pet_swath, t_swath = \
+        get_swath_data(swath_data, distance, line_shape)
+    # account for offset and scale (see functions/products.py)
+    pr_swath = mask_and_scale(pr_swath, var_products[0])
+    pet_swath = mask_and_scale(pet_swath, var_products[1])
+    t_swath = mask_and_scale(t_swath, var_products[2])
+
+    # aridity, PET, and P in elevation bands (bins are assigned once for all variables)
+    bin_edges, bands = elevation_bands(dem_swath, {"aridity": pet_swath/pr_swath, "pet": pet_swath, "p": pr_swath},
+                                       n_bins, band_mode)
+    bin_medians = (bin_edges[1:]+bin_edges[:-1])/2 # actually means...
+
+    return {"px": np.asarray(px), "py": np.asarray(py),
+            "bin_edges": bin_edges, "bin_medians": bin_medians,
+            "aridity_mean": bands["aridity"]["mean"], "aridity_std": bands["aridity"]["std"],
+            "pet_mean": bands["pet"]["mean"], "pet_std": bands["pet"]["std"],
+            "p_mean": bands["p"]["mean"], "p_std": bands["p"]["std"]}
+
+
+def swath_profile_task(task, **kwargs):
+    '''swath_profile for a (line_shape, cache_dir) task, e.g. to process the swaths of several regions with map_windows'''
+
+    line_shape, cache_dir = task
+
+    return swath_profile(line_shape, cache_dir=cache_dir, **kwargs)
@@ -0,0 +1,208 @@
+import os
+import json
+import hashlib
+import functools
+import numpy as np
+import pandas as pd
+import rasterio as rio
+from rasterio.windows import Window
+from functions.cell_area import cell_area
+from functions.products import mask_and_scale
+from functions.parallel import map_windows
+from functions.file_cache import file_fingerprint, atomic_savez, load_npz_or_none
+
+# This script contains functions to calculate area-weighted statistics per zone (e.g. landform)
+# for a RasterStack. The rasters are read window by window and only small partial aggregates
+# (weighted sums, weights, counts, min, max per zone) are kept in memory, so that global runs at
+# 30 arc seconds fit in a few GB. Partial aggregates can be merged and saved to resume a run,
+# and windows can be processed in parallel by several worker processes.
+
+
+def chunk_windows(stack, rows_per_chunk=None):
+    '''Full-width row strips aligned with the internal blocks of the first layer'''
+
+    with rio.open(stack.paths[0]) as src:
+        block_height = src.block_shapes[0][0]
+
+    if rows_per_chunk is None:
+        rows_per_chunk = block_height
+    else:
+        rows_per_chunk = max(1, rows_per_chunk // block_height) * block_height
+
+    return [Window(0, row, stack.width, min(rows_per_chunk, stack.height - row))
+            for row in range(0, stack.height, rows_per_chunk)]
+
+
+def empty_partial(n_vars, n_zones):
+    '''Partial aggregate without any cells'''
+
+    return {"count": np.zeros(n_zones),
+            "weight": np.zeros(n_zones),
+            "wsum": np.zeros((n_vars, n_zones)),
+            "min": np.full((n_vars, n_zones), np.inf),
+            "max": np.full((n_vars, n_zones), -np.inf)}
+
+
+def merge_partials(a, b):
+    '''Merge two partial aggregates (e.g. from different windows or workers)'''
+
+    return {"count": a["count"] + b["count"],
+            "weight": a["weight"] + b["weight"],
+            "wsum": a["wsum"] + b["wsum"],
+            "min": np.minimum(a["min"], b["min"]),
+            "max": np.maximum(a["max"], b["max"])}
+
+
+def zonal_partial(stack, window, zone_name, var_names, zones, valid_range=None, var_products=None):
+    '''Partial aggregate of var_names per zone for one window of the stack'''
+
+    if var_products is None:
+        var_products = {}
+
+    data = stack.read(window)
+    mask = stack.valid_mask(data, valid_range)
+
+    # map zone codes to positions in zones, codes outside of all zones are clipped to the
+    # last entry of lookup, which marks them with -1
+    zone = data[stack.names.index(zone_name)][mask]
+    lookup = np.full(int(max(zones)) + 2, -1)
+    lookup[np.asarray(zones, dtype=int)] = np.arange(len(zones))
+    sentinel = len(lookup) - 1
+    zone_ind = lookup[np.where((zone < 0) | (zone > sentinel), sentinel, zone).astype(int)]
+    inside = zone_ind >= 0
+    zone_ind = zone_ind[inside]
+    area = cell_area(stack, window)[mask][inside]
+
+    partial = empty_partial(len(var_names), len(zones))
+    partial["count"] = np.bincount(zone_ind, minlength=len(zones)).astype(float)
+    partial["weight"] = np.bincount(zone_ind, weights=area, minlength=len(zones))
+    for i, var in enumerate(var_names):
+        values = data[stack.names.index(var)][mask][inside].astype(np.float64)
+        if var in var_products:
+            values = mask_and_scale(values, var_products[var])
+        partial["wsum"][i] = np.bincount(zone_ind, weights=values * area, minlength=len(zones))
+        np.minimum.at(partial["min"][i], zone_ind, values)
+        np.maximum.at(partial["max"][i], zone_ind, values)
+
+    return partial
+
+
+def valid_cells(stack, window, valid_range=None, class_layers=None, coords=True):
+    '''Table of all valid cells of one window (all layers, coordinates, and area)'''
+
+    # without class_layers, cells need to be valid in all layers; class_layers (e.g. landform codes)
+    # are stored as uint8 (0 where invalid), cells only need to be valid in the other layers, and
+    # bit i of the column "valid" is set where the i-th class layer is valid (the area is stored as
+    # float32 then), coords=True adds lon and lat, "rowcol" the row and col index (see RasterStack.to_columns)
+    data = stack.read(window)
+    if class_layers is None:
+        mask = stack.valid_mask(data, valid_range)
+        df = pd.DataFrame(stack.to_columns(data, mask, window, coords))
+        df["area"] = cell_area(stack, window)[mask]
+        return df
+
+    if len(class_layers) > 8:
+        raise ValueError('The validity bitmask holds at most 8 class layers.')
+    class_index = [stack.names.index(name) for name in class_layers]
+    mask = np.ones(data.shape[1:], dtype=bool)
+    for i in range(len(stack)):
+        if i not in class_index:
+            mask &= stack.layer_mask(data, i, valid_range)
+
+    columns = stack.to_columns(data, mask, window, coords)
+    valid = np.zeros(np.count_nonzero(mask), dtype=np.uint8)
+    for bit, (name, i) in enumerate(zip(class_layers, class_index)):
+        layer_valid = stack.layer_mask(data, i, valid_range)[mask]
+        columns[name] = np.where(layer_valid, columns[name], 0).astype(np.uint8)
+        valid |= layer_valid.astype(np.uint8) << bit
+    columns["valid"] = valid
+    df = pd.DataFrame(columns)
+    df["area"] = cell_area(stack, window)[mask].astype(np.float32)
+
+    return df
+
+
+def checkpoint_key(stack, zone_name, var_names, zones, valid_range, var_products, n_windows):
+    '''Hash of everything a partial aggregate depends on (rasters, variables, zones, valid ranges, products, windows)'''
+
+    rasters = [file_fingerprint(path) for path in stack.paths]
+    content = {"rasters": rasters, "names": stack.names, "zone_name": zone_name, "var_names": list(var_names),
+               "zones": [int(zone) for zone in zones], "valid_range": valid_range, "var_products": var_products,
+               "n_windows": n_windows}
+
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=float).encode()).hexdigest()
+
+
+def save_partial(path, partial, done, key):
+    # written atomically, so that an interrupted run never leaves a broken checkpoint
+    atomic_savez(path, done=done, key=np.array(key), **partial)
+
+
+def load_partial(path, key):
+    # None if there is no (readable) checkpoint
+    checkpoint = load_npz_or_none(path)
+    if checkpoint is None:
+        return None
+    if "key" not in checkpoint or str(checkpoint["key"]) != key:
+        raise ValueError('Checkpoint ' + path + ' was created for different rasters, variables, zones, '
+                         'valid ranges, products, or windows (delete it to start over).')
+    partial = {name: checkpoint[name] for name in ["count", "weight", "wsum", "min", "max"]}
+
+    return partial, checkpoint["done"]
+
+
+def zonal_stats(stack, zone_name, var_names, zones=(1, 2, 3, 4), valid_range=None, var_products=None,
+                rows_per_chunk=None, checkpoint_path=None, checkpoint_every=10, n_workers=1):
+    '''Area-weighted partial aggregate of var_names per zone, streamed window by window'''
+
+    # var_products maps a variable name to a product, whose scale and offset are applied before
+    # aggregating (see functions/products.py)
+    windows = chunk_windows(stack, rows_per_chunk)
+
+    # the checkpoint is only used for the same inputs (see checkpoint_key) and removed when all windows are done
+    key = checkpoint_key(stack, zone_name, var_names, zones, valid_range, var_products, len(windows))
+    partial = empty_partial(len(var_names), len(zones))
+    done = np.zeros(len(windows), dtype=bool)
+    resumed = None if checkpoint_path is None else load_partial(checkpoint_path, key)
+    if resumed is not None:
+        partial, done = resumed
+        print("Resuming with " + str(done.sum()) + " of " + str(len(windows)) + " windows done.")
+
+    todo = np.flatnonzero(~done)
+    function = functools.partial(zonal_partial, stack, zone_name=zone_name, var_names=var_names, zones=zones,
+                                 valid_range=valid_range, var_products=var_products)
+    for n, (i, result) in enumerate(map_windows(function, [windows[i] for i in todo], n_workers)):
+        partial = merge_partials(partial, result)
+        done[todo[i]] = True
+        if checkpoint_path is not None and ((n + 1) % checkpoint_every == 0 or n + 1 == len(todo)):
+            save_partial(checkpoint_path, partial, done, key)
+
+    if checkpoint_path is not None and os.path.isfile(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    return partial
+
+
+def zonal_table(partial, var_names, zones=(1, 2, 3, 4), zone_groups=None):
+    '''Table with area, count, and area-weighted mean, min, and max per zone (and merged zones)'''
+
+    # zone_groups maps a new zone code to a list of zones, e.g. {5: [1, 2, 3], 6: [4]}
+    if zone_groups is None:
+        zone_groups = {}
+
+    rows = {zone: [i] for i, zone in enumerate(zones)}
+    for group, members in zone_groups.items():
+        rows[group] = [list(zones).index(member) for member in members]
+    rows["all"] = list(range(len(zones)))
+
+    results = []
+    for label, ind in rows.items():
+        weight = partial["weight"][ind].sum()
+        row = {"zone": label, "area": weight, "count": partial["count"][ind].sum()}
+        for i, var in enumerate(var_names):
+            row[var + "_mean"] = partial["wsum"][i, ind].sum() / weight if weight > 0 else np.nan
+            row[var + "_min"] = partial["min"][i, ind].min() if weight > 0 else np.nan
+            row[var + "_max"] = partial["max"][i, ind].max() if weight > 0 else np.nan
+        results.append(row)
+
+    return pd.DataFrame(results).set_index("zone")
@@ -10,7 +10,7 @@ from functions.get_geometries import get_strike_geometries
 from functions.get_perp_pts import perp_pts
 from functions.create_shapefiles import create_line_shp
 from functions.create_shapefiles import create_polygon_shp
-from functions.get_swath_data import get_swath_data
+from functions.get_swath_data import get_swath_data, stack_orig_curv
 from functions.get_geometries import get_swath_indices
 from scipy import stats
 
@@ -160,7 +160,7 @@ for name in name_list:
             #axes.plot(px, py, c='silver')
 
         dist, dem_swath, pr_swath, pet_swath, t_swath = \
-            get_swath_data(orig_dem, orig_pr, orig_pet, orig_t, line_shape)
+            get_swath_data(*stack_orig_curv(orig_dem, orig_pr, orig_pet, orig_t), line_shape)
         # account for offset and scale
         pr_swath = pr_swath * 0.1 #
         pet_swath = pet_swath * 0.1 # also convert to mm/y
@@ -5,6 +5,7 @@ from shapely.geometry import mapping
 import rioxarray as rxr
 import geopandas as gpd
 from scipy import stats
+from functions.elevation_bands import elevation_bands
 
 #todo: clean up a bit...
 
@@ -131,33 +132,17 @@ for mountain_name in mountain_list:
 
     plot_idx = np.random.permutation(x1.shape[0])
 
-    bin_edges = stats.mstats.mquantiles(y, np.linspace(0,1,51))
-
-    mean_stat1 = stats.binned_statistic(y, x1, statistic=lambda y: np.nanmean(y), bins=bin_edges)
-    std_stat1 = stats.binned_statistic(y, x1, statistic=lambda y: np.nanstd(y), bins=bin_edges)
-    median_stat1 = stats.binned_statistic(y, x1, statistic=np.nanmedian, bins=bin_edges) #bins=nbins, range=bin_range
-    p_lower_stat1 = stats.binned_statistic(y, x1, statistic=lambda y: np.quantile(y, .25), bins=bin_edges)
-    p_upper_stat1 = stats.binned_statistic(y, x1, statistic=lambda y: np.quantile(y, .75), bins=bin_edges)
-    asymmetric_error1 = [median_stat1.statistic - p_lower_stat1.statistic,
-                         p_upper_stat1.statistic - median_stat1.statistic]
-
-    mean_stat2 = stats.binned_statistic(y, x2, statistic=lambda y: np.nanmean(y), bins=bin_edges)
-    std_stat2 = stats.binned_statistic(y, x2, statistic=lambda y: np.nanstd(y), bins=bin_edges)
-    median_stat2 = stats.binned_statistic(y, x2, statistic=np.nanmedian, bins=bin_edges) #bins=nbins, range=bin_range
-    p_lower_stat2 = stats.binned_statistic(y, x2, statistic=lambda y: np.quantile(y, .25), bins=bin_edges)
-    p_upper_stat2 = stats.binned_statistic(y, x2, statistic=lambda y: np.quantile(y, .75), bins=bin_edges)
-    asymmetric_error2 = [median_stat2.statistic - p_lower_stat2.statistic,
-                         p_upper_stat2.statistic - median_stat2.statistic]
-
-    mean_stat3 = stats.binned_statistic(y, x3, statistic=lambda y: np.nanmean(y), bins=bin_edges)
-    std_stat3 = stats.binned_statistic(y, x3, statistic=lambda y: np.nanstd(y), bins=bin_edges)
-    median_stat3 = stats.binned_statistic(y, x3, statistic=np.nanmedian, bins=bin_edges)  # bins=nbins, range=bin_range
-    p_lower_stat3 = stats.binned_statistic(y, x3, statistic=lambda y: np.quantile(y, .25), bins=bin_edges)
-    p_upper_stat3 = stats.binned_statistic(y, x3, statistic=lambda y: np.quantile(y, .75), bins=bin_edges)
-    asymmetric_error3 = [median_stat3.statistic - p_lower_stat3.statistic,
-                         p_upper_stat3.statistic - median_stat3.statistic]
-
-    #bin_means = (mean_stat1.bin_edges[1:] + mean_stat1.bin_edges[0:-1]) / 2
+    # P, PET, and T in 50 elevation bands with equal counts (bins are assigned once for all variables)
+    bin_edges, bands = elevation_bands(y, {"P": x1, "PET": x2, "T": x3}, n_bins=50, mode="count",
+                                       quantiles=(.25, .5, .75))
+    asymmetric_error1 = [bands["P"]["quantiles"][1] - bands["P"]["quantiles"][0],
+                         bands["P"]["quantiles"][2] - bands["P"]["quantiles"][1]]
+    asymmetric_error2 = [bands["PET"]["quantiles"][1] - bands["PET"]["quantiles"][0],
+                         bands["PET"]["quantiles"][2] - bands["PET"]["quantiles"][1]]
+    asymmetric_error3 = [bands["T"]["quantiles"][1] - bands["T"]["quantiles"][0],
+                         bands["T"]["quantiles"][2] - bands["T"]["quantiles"][1]]
+
+    #bin_means = (bin_edges[1:] + bin_edges[0:-1]) / 2
     bin_medians = stats.mstats.mquantiles(y, np.linspace(0.05,0.95,50))
 
     f, ax = plt.subplots(figsize=(4, 4))
@@ -165,22 +150,22 @@ for mountain_name in mountain_list:
     #ax.plot(x, y, 'o', mfc='none', markersize=.1, alpha=0.1)
     sc = ax.scatter(x1, y, s=0.025, c='tab:blue', alpha=0.05)
     sc = ax.scatter(x2, y, s=0.025, c='tab:orange', alpha=0.05)
-    ax.errorbar(median_stat1.statistic, bin_medians, xerr=asymmetric_error1, yerr=None,
+    ax.errorbar(bands["P"]["quantiles"][1], bin_medians, xerr=asymmetric_error1, yerr=None,
                 capsize=2, fmt='s', ms=4, elinewidth=1, c='tab:blue', mfc='white', alpha=0.7)
-    ax.errorbar(median_stat2.statistic, bin_medians, xerr=asymmetric_error2, yerr=None,
+    ax.errorbar(bands["PET"]["quantiles"][1], bin_medians, xerr=asymmetric_error2, yerr=None,
                 capsize=2, fmt='s', ms=4, elinewidth=1, c='tab:orange', mfc='white', alpha=0.7)
     """
-    ax.plot(mean_stat1.statistic, bin_medians, c='tab:blue', label='Precipitation')
-    ax.fill_betweenx(bin_medians, mean_stat1.statistic - std_stat1.statistic, mean_stat1.statistic + std_stat1.statistic,
+    ax.plot(bands["P"]["mean"], bin_medians, c='tab:blue', label='Precipitation')
+    ax.fill_betweenx(bin_medians, bands["P"]["mean"] - bands["P"]["std"], bands["P"]["mean"] + bands["P"]["std"],
                      facecolor='tab:blue', alpha=0.25)
 
-    ax.plot(mean_stat2.statistic, bin_medians, c='tab:orange', label='Potential evapotranspiration')
-    ax.fill_betweenx(bin_medians, mean_stat2.statistic - std_stat2.statistic, mean_stat2.statistic + std_stat2.statistic,
+    ax.plot(bands["PET"]["mean"], bin_medians, c='tab:orange', label='Potential evapotranspiration')
+    ax.fill_betweenx(bin_medians, bands["PET"]["mean"] - bands["PET"]["std"], bands["PET"]["mean"] + bands["PET"]["std"],
                      facecolor='tab:orange', alpha=0.25)
 
-    #ax.plot(mean_stat3.statistic, bin_medians, c='tab:purple', label='Temperature')
-    #ax.fill_betweenx(bin_medians, mean_stat3.statistic - std_stat3.statistic,
-    #                 mean_stat3.statistic + std_stat3.statistic,
+    #ax.plot(bands["T"]["mean"], bin_medians, c='tab:purple', label='Temperature')
+    #ax.fill_betweenx(bin_medians, bands["T"]["mean"] - bands["T"]["std"],
+    #                 bands["T"]["mean"] + bands["T"]["std"],
     #                 facecolor='tab:purple', alpha=0.25)
 
     ax.set_ylabel('Elevation [m]')
@@ -6,7 +6,7 @@ from functions.get_geometries import get_swath_geometries
 from functions.create_shapefiles import create_line_shp
 from functions.create_shapefiles import create_polygon_shp
 import os
-from functions.get_swath_data import get_swath_data
+from functions.get_swath_data import get_swath_data, stack_orig_curv
 
 #todo: clean up a bit...
 
@@ -97,7 +97,7 @@ for name in name_list:
 
     # plot swath profile
     dist, dem_swath, pr_swath, pet_swath, t_swath = \
-        get_swath_data(orig_dem, orig_pr, orig_pet, orig_t, line_shape) #add orig_vap
+        get_swath_data(*stack_orig_curv(orig_dem, orig_pr, orig_pet, orig_t), line_shape) #add orig_vap
 
     axes1.fill_between(dist, np.zeros(len(dist)), dem_swath.mean(axis=1),
                        facecolor='tab:gray', alpha=0.25, label='Elevation')
@@ -6,7 +6,7 @@ from functions.get_geometries import get_swath_geometries
 from functions.create_shapefiles import create_line_shp
 from functions.create_shapefiles import create_polygon_shp
 import os
-from functions.get_swath_data import get_swath_data
+from functions.get_swath_data import get_swath_data, stack_orig_curv
 
 # specify paths
 #data_path = r"C:/Users/Sebastian/Documents/Data/"
@@ -99,7 +99,7 @@ for name in name_list:
 
     # plot swath profile
     dist, dem_swath, pr_swath, pet_swath, t_swath = \
-        get_swath_data(orig_dem, orig_pr, orig_pet, orig_t, line_shape) #add orig_vap
+        get_swath_data(*stack_orig_curv(orig_dem, orig_pr, orig_pet, orig_t), line_shape) #add orig_vap
     # account for offset and scale
     pr_swath = pr_swath*0.1 #
     pet_swath = pet_swath*0.01*12 # also convert to mm/y
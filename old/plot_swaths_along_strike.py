@@ -10,7 +10,7 @@ from functions.get_geometries import get_strike_geometries
 from functions.get_perp_pts import perp_pts
 from functions.create_shapefiles import create_line_shp
 from functions.create_shapefiles import create_polygon_shp
-from functions.get_swath_data import get_swath_data
+from functions.get_swath_data import get_swath_data, stack_orig_curv
 
 # specify paths
 data_path = r"C:/Users/Sebastian/Documents/Data/"
@@ -150,7 +150,7 @@ for name in name_list:
         ### PLOTS showing transects for individual swaths ###
         try:
             dist, dem_swath, pr_swath, pet_swath, t_swath = \
-                get_swath_data(orig_dem, orig_pr, orig_pet, orig_t, line_shape)
+                get_swath_data(*stack_orig_curv(orig_dem, orig_pr, orig_pet, orig_t), line_shape)
 
             # plot the swath profile lines
             fig1 = plt.figure(figsize=(8, 3), constrained_layout=True)
@@ -1,17 +1,19 @@
 import os
+import functools
 import matplotlib.pyplot as plt
 import numpy as np
-import rioxarray as rxr
+import pandas as pd
 import pyosp
 from matplotlib.pyplot import cm
 from functions.get_geometries import get_strike_geometries
-from functions.get_perp_pts import perp_pts
-from functions.create_shapefiles import create_line_shp
-from functions.get_swath_data import get_swath_data
+from functions.get_perp_pts import perp_pts_line
+from functions.create_shapefiles import create_line, create_lines_shp
+from functions.sample_swath import interpolate_line
+from functions.swath_profiles import swath_profile_task
+from functions.parallel import map_windows
+from functions.background_map import plot_background
+from functions.lapse_rates import lapse_rates
 from functions.get_geometries import get_swath_indices
-from scipy import stats
-from shapely.geometry import MultiPoint
-from sklearn.linear_model import LinearRegression
 
 # Creates plots of elevation vs. the climatic water balance for several swaths in different mountain regions.
 
@@ -19,6 +21,11 @@ from sklearn.linear_model import LinearRegression
 data_path = r"C:/Users/Sebastian/Documents/Data/"
 data_path = r"D:/Data/"
 results_path = "results/"
+save_shapefiles = True # write the baselines of all swaths of a region as one shapefile (optional side output)
+n_workers = os.cpu_count() # number of parallel worker processes (1 processes all swaths one after another)
+use_cache = True # reuse sampled swaths from results/<region>/cache/ (see functions/swath_cache.py)
+cache_max_size = 2 * 1024 ** 3 # bytes per region
+cache_max_age = 90 * 24 * 3600 # seconds
 
 dem_path = data_path + "WorldClim/wc2.1_30s_elev/wc2.1_30s_elev.tif"
 pr_path = data_path + "WorldClim/wc2.1_30s_bio/wc2.1_30s_bio_12.tif"
@@ -32,182 +39,175 @@ t_path = data_path + "CHELSA/CHELSA_bio1_1981-2010_V.2.1.tif"
 # smooth lines along main arcs were created manually in QGIS, based on objective criteria (watershed boundaries etc.)
 name_list = ["Cordillera Central Ecuador", "Himalaya", "Sierra Nevada", "European Alps"]
 
-# load dem shapefile
-dem = rxr.open_rasterio(dem_path, masked=True).squeeze()
+# swath dimensions
+d = 2.0 # length of swath
+w = 0.5 # width
+line_stepsize = 0.05
+cross_stepsize = 0.05
 
-for name in name_list:
+# the extraction runs in worker processes, which re-import this script where fork is not available
+# (e.g. on Windows), so everything below only runs in the main process
+if __name__ == "__main__":
 
-    print(name)
+    # create the baselines of all swaths of all regions
+    regions = {}
+    tasks = []
+    for name in name_list:
 
-    # check if folders exist
-    path = results_path + name + "/shapefiles/"
-    if not os.path.isdir(path):
-        os.makedirs(path)
+        print(name)
 
-    path = results_path + name + "/swaths_elevation_profiles/"
-    if not os.path.isdir(path):
-        os.makedirs(path)
+        # check if folders exist
+        path = results_path + name + "/shapefiles/"
+        if not os.path.isdir(path):
+            os.makedirs(path)
 
-    # remove all files in folder
-    for f in os.listdir(path):
-        os.remove(os.path.join(path, f))
+        path = results_path + name + "/swaths_elevation_profiles/"
+        if not os.path.isdir(path):
+            os.makedirs(path)
 
-    line_path, xlim, ylim = get_strike_geometries(name)
-    swath_ind, forcinglim = get_swath_indices(name)
+        # remove all files in folder
+        for f in os.listdir(path):
+            os.remove(os.path.join(path, f))
 
-    # create line
-    line = pyosp.read_shape(line_path)
+        line_path, xlim, ylim = get_strike_geometries(name)
+        swath_ind, forcinglim = get_swath_indices(name)
 
-    # swath dimensions
-    d = 2.0 # length of swath
-    w = 0.5 # width
-    distances = np.arange(0, line.length, w)[:-1]
-    points = [line.interpolate(distance) for distance in distances] + [line.boundary[1]]
-    mp = MultiPoint(list(points))
+        # create line
+        line = pyosp.read_shape(line_path)
 
-    ### PLOT 1 ###
-    # plot the swaths on top of the DEM
-    fig = plt.figure(figsize=(4, 4), constrained_layout=True)
-    axes = plt.axes()
+        distances = np.arange(0, line.length, w)[:-1]
+        xs, ys, _, _ = interpolate_line(line, distances)
+        xs = np.append(xs, line.coords[-1][0])
+        ys = np.append(ys, line.coords[-1][1])
 
-    sp0 = dem.plot.imshow(ax=axes, cmap='gray')
-    axes.set(title=None)  # "DEM [m]"
-    # axes.set_axis_off()
-    axes.axis('equal')
-    axes.set_xlim(xlim)
-    axes.set_ylim(ylim)
-    axes.set_xlabel('Lon [deg]')
-    axes.set_ylabel('Lat [deg]')
-    sp0.colorbar.set_label('Elevation [m]')
-    sp0.set_clim([0, 3000])
-
-    x, y = line.xy
-
-    color = iter(cm.plasma(np.linspace(0, 1, len(swath_ind)*2)))
-
-    # loop over swaths
-    for p in range(0, len(mp)-1):
-
-        print('')
-        print(p)
-
-        xs = [point.x for point in mp]
-        ys = [point.y for point in mp]
-        xx = (np.array(xs[1:])+np.array(xs[0:-1]))/2
-        yy = (np.array(ys[1:])+np.array(ys[0:-1]))/2
-
-        m = (ys[p+1] - ys[p]) / (xs[p+1] - xs[p])
-        x1, y1, x2, y2 = perp_pts(xx[p], yy[p], m, d, [xs[p], ys[p], xs[p+1], ys[p+1]])
+        # midpoints and perpendicular points of all swaths at once
+        xx, yy, x1, y1, x2, y2 = perp_pts_line(xs, ys, d)
 
         # create line (typically goes from north to south - curved lines can make this a bit tricky...)
-        baseline = results_path + name + '/shapefiles/line_tmp.shp'
         if name in ["Cordillera Central Ecuador", "Sierra Nevada", "Himalaya"]:
-            create_line_shp([x1, xx[p], y1, yy[p]], baseline)
-        else:
-            create_line_shp([x2, xx[p], y2, yy[p]], baseline)
-
-        line_shape = pyosp.read_shape(baseline)
-        lx, ly = line_shape.xy
-
-        # generate swath objects
-        line_stepsize = 0.05
-        cross_stepsize = 0.05
-        orig_dem = pyosp.Orig_curv(baseline, dem_path, width=w, line_stepsize=line_stepsize, cross_stepsize=cross_stepsize)
-        orig_pr = pyosp.Orig_curv(baseline, pr_path, width=w, line_stepsize=line_stepsize, cross_stepsize=cross_stepsize)
-        orig_pet = pyosp.Orig_curv(baseline, pet_path, width=w, line_stepsize=line_stepsize, cross_stepsize=cross_stepsize)
-        orig_t = pyosp.Orig_curv(baseline, t_path, width=w, line_stepsize=line_stepsize, cross_stepsize=cross_stepsize)
-
-        swath_polylines = orig_dem.out_polylines()
-
-        x, y = line.xy
-        axes.plot(x, y, color='tab:red')
-
-        swath_polygon = orig_dem.out_polygon()
-        px, py = swath_polygon.exterior.xy
-
-        if p in swath_ind:
-            #nextcolor = next(color)
-            axes.plot(px, py, c='tab:orange')
+            baselines = [create_line([x1[p], xx[p], y1[p], yy[p]]) for p in range(0, len(xs)-1)]
         else:
-            pass
-
-        dist, dem_swath, pr_swath, pet_swath, t_swath = \
-            get_swath_data(orig_dem, orig_pr, orig_pet, orig_t, line_shape)
-        # account for offset and scale (only for CHELSA)
-        pr_swath = pr_swath * 0.1
-        pet_swath = pet_swath * 0.01 * 12
-        t_swath = t_swath * 0.1 - 273.15
-
-        # plot elevation profile
-        if p in swath_ind:
-
-            ### PLOT 2 ###
-            # aridity elevation profiles
-            fig2 = plt.figure(figsize=(2, 2), constrained_layout=True)
-            axes2 = plt.axes()
-
-            ### PLOT 3 ###
-            # PET and P elevation profiles
-            fig3 = plt.figure(figsize=(2, 2), constrained_layout=True)
-            axes3 = plt.axes()
-
-            # aridity
-            aridity = (pet_swath/pr_swath).flatten()
-            n_bins = 10
-            bin_edges = np.linspace(np.min(dem_swath.flatten()), np.max(dem_swath.flatten()), n_bins+1)
-            bin_medians = (bin_edges[1:]+bin_edges[:-1])/2 # actually means...
-            mean_stat = stats.binned_statistic(dem_swath.flatten(), aridity, statistic=lambda y: np.nanmean(y), bins=bin_edges)
-            std_stat = stats.binned_statistic(dem_swath.flatten(), aridity, statistic=lambda y: np.nanstd(y), bins=bin_edges)
-
-            # PET and P
-            mean_stat_PET = stats.binned_statistic(dem_swath.flatten(), pet_swath.flatten(), statistic=lambda y: np.nanmean(y), bins=bin_edges)
-            std_stat_PET = stats.binned_statistic(dem_swath.flatten(), pet_swath.flatten(), statistic=lambda y: np.nanstd(y), bins=bin_edges)
-            mean_stat_P = stats.binned_statistic(dem_swath.flatten(), pr_swath.flatten(), statistic=lambda y: np.nanmean(y), bins=bin_edges)
-            std_stat_P = stats.binned_statistic(dem_swath.flatten(), pr_swath.flatten(), statistic=lambda y: np.nanstd(y), bins=bin_edges)
-
-            axes2.plot(mean_stat.statistic, bin_medians, color='tab:green') #nextcolor
-            axes2.fill_betweenx(bin_medians, mean_stat.statistic - std_stat.statistic,
-                             mean_stat.statistic + std_stat.statistic, facecolor='tab:green', alpha=0.25) #nextcolor
-
-
-            axes3.plot(mean_stat_PET.statistic, bin_medians, color='tab:orange')
-            axes3.fill_betweenx(bin_medians, mean_stat_PET.statistic - std_stat_PET.statistic,
-                             mean_stat_PET.statistic + std_stat_PET.statistic, facecolor='tab:orange', alpha=0.25)
-            axes3.plot(mean_stat_P.statistic, bin_medians, color='tab:blue')
-            axes3.fill_betweenx(bin_medians, mean_stat_P.statistic - std_stat_P.statistic,
-                             mean_stat_P.statistic + std_stat_P.statistic, facecolor='tab:blue', alpha=0.25)
-
-            axes2.plot(np.ones_like(np.linspace(0,bin_edges[-1],10)), np.linspace(0,bin_edges[-1],10), '--', c='gray', linewidth=0.5)
-            axes2.set_xlabel('PET/P [-]')
-            axes2.set_ylabel('Elevation [m]')
-            axes2.set_xlim([0.1, 10])
-            axes2.set_xscale('log')
-            axes2.set_xticks(ticks=[0.2, 0.5, 1, 2, 5], labels=["0.2", "0.5", "1", "2", "5"])
-            axes2.set_ylim([0, 6000])
-            # plt.show()
-            fig2.savefig(results_path + name + "/swaths_elevation_profiles/" + "swaths_elevation_profiles_" + name + "_" + str(p) + ".png", dpi=600, bbox_inches='tight')
-            plt.close(fig2)
-
-            axes3.set_xlabel('Flux [mm/y]')
-            axes3.set_ylabel('Elevation [m]')
-            axes3.set_xlim(forcinglim)
-            axes3.set_ylim([0, 6000])
-            # plt.show()
-            axes3.grid(linewidth=0.5,color="lightgrey")
-            fig3.savefig(results_path + name + "/swaths_elevation_profiles/" + "swaths_elevation_profiles_PET_P_" + name + "_" + str(p) + ".png", dpi=600, bbox_inches='tight')
-            plt.close(fig3)
-
-            # print gradients
-            try:
-                print(" ")
-                reg = LinearRegression().fit(bin_medians.reshape(-1, 1),mean_stat_PET.statistic.reshape(-1, 1))
-                print("PET lapse rate "+str(reg.coef_))
-                reg = LinearRegression().fit(bin_medians.reshape(-1, 1),mean_stat_P.statistic.reshape(-1, 1))
-                print("P lapse rate " + str(reg.coef_))
-                print(" ")
-            except:
-                print("Gradients couldn't be calculated.")
-
-    # plt.show()
-    fig.savefig(results_path + name + "/swaths_elevation_profiles/" + "swaths_" + name + ".png", dpi=600, bbox_inches='tight')
-    plt.close(fig)
+            baselines = [create_line([x2[p], xx[p], y2[p], yy[p]]) for p in range(0, len(xs)-1)]
+
+        # save the baselines of all swaths as one shapefile
+        if save_shapefiles:
+            create_lines_shp(baselines, results_path + name + '/shapefiles/lines.shp')
+
+        regions[name] = {"line": line, "baselines": baselines, "swath_ind": swath_ind,
+                         "forcinglim": forcinglim, "xlim": xlim, "ylim": ylim}
+        # only the swaths that are plotted need to be extracted
+        tasks += [(name, p) for p in range(0, len(baselines)) if p in swath_ind]
+
+    # extract all swaths and calculate their elevation profiles (in parallel, each swath is independent)
+    function = functools.partial(swath_profile_task, paths=[dem_path, pr_path, pet_path, t_path], width=w,
+                                 line_stepsize=line_stepsize, cross_stepsize=cross_stepsize,
+                                 cache_max_size=cache_max_size, cache_max_age=cache_max_age)
+    swath_tasks = [(regions[name]["baselines"][p], results_path + name + "/cache/" if use_cache else None)
+                   for name, p in tasks]
+    records = {}
+    for i, record in map_windows(function, swath_tasks, n_workers):
+        records[tasks[i]] = record
+
+    # plot the results
+    for name in name_list:
+
+        print(name)
+
+        line = regions[name]["line"]
+        swath_ind = regions[name]["swath_ind"]
+        forcinglim = regions[name]["forcinglim"]
+
+        ### PLOT 1 ###
+        # plot the swaths on top of the DEM
+        fig = plt.figure(figsize=(4, 4), constrained_layout=True)
+        axes = plt.axes()
+
+        # only the region is read, at the resolution of the figure (see functions/background_map.py)
+        sp0 = plot_background(axes, dem_path, regions[name]["xlim"], regions[name]["ylim"],
+                              cache_dir=results_path + name + "/cache/" if use_cache else None, cmap='gray')
+        axes.set(title=None)  # "DEM [m]"
+        # axes.set_axis_off()
+        axes.axis('equal')
+        axes.set_xlim(regions[name]["xlim"])
+        axes.set_ylim(regions[name]["ylim"])
+        axes.set_xlabel('Lon [deg]')
+        axes.set_ylabel('Lat [deg]')
+        sp0.colorbar.set_label('Elevation [m]')
+        sp0.set_clim([0, 3000])
+
+        color = iter(cm.plasma(np.linspace(0, 1, len(swath_ind)*2)))
+
+        # loop over swaths
+        for p in range(0, len(regions[name]["baselines"])):
+
+            x, y = line.xy
+            axes.plot(x, y, color='tab:red')
+
+            # plot elevation profile
+            if p in swath_ind:
+
+                print('')
+                print(p)
+
+                record = records[(name, p)]
+                bin_edges = record["bin_edges"]
+                bin_medians = record["bin_medians"]
+
+                #nextcolor = next(color)
+                axes.plot(record["px"], record["py"], c='tab:orange')
+
+                ### PLOT 2 ###
+                # aridity elevation profiles
+                fig2 = plt.figure(figsize=(2, 2), constrained_layout=True)
+                axes2 = plt.axes()
+
+                ### PLOT 3 ###
+                # PET and P elevation profiles
+                fig3 = plt.figure(figsize=(2, 2), constrained_layout=True)
+                axes3 = plt.axes()
+
+                axes2.plot(record["aridity_mean"], bin_medians, color='tab:green') #nextcolor
+                axes2.fill_betweenx(bin_medians, record["aridity_mean"] - record["aridity_std"],
+                                 record["aridity_mean"] + record["aridity_std"], facecolor='tab:green', alpha=0.25) #nextcolor
+
+
+                axes3.plot(record["pet_mean"], bin_medians, color='tab:orange')
+                axes3.fill_betweenx(bin_medians, record["pet_mean"] - record["pet_std"],
+                                 record["pet_mean"] + record["pet_std"], facecolor='tab:orange', alpha=0.25)
+                axes3.plot(record["p_mean"], bin_medians, color='tab:blue')
+                axes3.fill_betweenx(bin_medians, record["p_mean"] - record["p_std"],
+                                 record["p_mean"] + record["p_std"], facecolor='tab:blue', alpha=0.25)
+
+                axes2.plot(np.ones_like(np.linspace(0,bin_edges[-1],10)), np.linspace(0,bin_edges[-1],10), '--', c='gray', linewidth=0.5)
+                axes2.set_xlabel('PET/P [-]')
+                axes2.set_ylabel('Elevation [m]')
+                axes2.set_xlim([0.1, 10])
+                axes2.set_xscale('log')
+                axes2.set_xticks(ticks=[0.2, 0.5, 1, 2, 5], labels=["0.2", "0.5", "1", "2", "5"])
+                axes2.set_ylim([0, 6000])
+                # plt.show()
+                fig2.savefig(results_path + name + "/swaths_elevation_profiles/" + "swaths_elevation_profiles_" + name + "_" + str(p) + ".png", dpi=600, bbox_inches='tight')
+                plt.close(fig2)
+
+                axes3.set_xlabel('Flux [mm/y]')
+                axes3.set_ylabel('Elevation [m]')
+                axes3.set_xlim(forcinglim)
+                axes3.set_ylim([0, 6000])
+                # plt.show()
+                axes3.grid(linewidth=0.5,color="lightgrey")
+                fig3.savefig(results_path + name + "/swaths_elevation_profiles/" + "swaths_elevation_profiles_PET_P_" + name + "_" + str(p) + ".png", dpi=600, bbox_inches='tight')
+                plt.close(fig3)
+
+        # plt.show()
+        fig.savefig(results_path + name + "/swaths_elevation_profiles/" + "swaths_" + name + ".png", dpi=600, bbox_inches='tight')
+        plt.close(fig)
+
+        # lapse rates of all swaths at once (NaN if they can't be calculated, e.g. because of empty bins)
+        swaths = [p for task_name, p in tasks if task_name == name]
+        if swaths:
+            gradients = lapse_rates(np.array([records[(name, p)]["bin_medians"] for p in swaths]),
+                                    {"PET": np.array([records[(name, p)]["pet_mean"] for p in swaths]),
+                                     "P": np.array([records[(name, p)]["p_mean"] for p in swaths])},
+                                    index=pd.Index(swaths, name="swath"))
+            gradients.to_csv(results_path + name + "/swaths_elevation_profiles/" + "lapse_rates_" + name + ".csv")
+            print(gradients[["PET_lapse_rate", "P_lapse_rate"]])
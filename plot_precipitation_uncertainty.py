@@ -1,12 +1,14 @@
 import matplotlib.pyplot as plt
 import numpy as np
-import rioxarray as rxr
-import pyosp
 from functions.get_geometries import get_swath_geometries
-from functions.create_shapefiles import create_line_shp
+from functions.create_shapefiles import create_line, create_lines_shp
 from functions.create_shapefiles import create_polygon_shp
 import os
 from functions.get_swath_data import get_swath_data
+from functions.sample_swath import swath_polylines, swath_polygon, line_distance_km
+from functions.swath_cache import cached_sample_swath
+from functions.background_map import plot_background
+from functions.products import mask_and_scale
 
 # Plots transects using different forcing products (e.g. P, PET) along swaths in different mountain regions.
 
@@ -14,6 +16,10 @@ from functions.get_swath_data import get_swath_data
 #data_path = r"C:/Users/Sebastian/Documents/Data/"
 data_path = r"D:/Data/"
 results_path = "results/"
+save_shapefiles = True # write baseline and swath polygon as shapefiles (optional side output)
+use_cache = True # reuse sampled swaths from results/<region>/cache/ (see functions/swath_cache.py)
+cache_max_size = 2 * 1024 ** 3 # bytes per region
+cache_max_age = 90 * 24 * 3600 # seconds
 
 shp_path = data_path + "GMBA mountain inventory V1.2(entire world)/GMBA Mountain Inventory_v1.2-World.shp"
 dem_path = data_path + "WorldClim/wc2.1_30s_elev/wc2.1_30s_elev.tif" # code currently only works with that DEM
@@ -27,9 +33,6 @@ t_path = data_path + "CHELSA/CHELSA_bio1_1981-2010_V.2.1.tif"
 
 name_list = ["Ethiopian Highlands", "Southern Andes", "Cascade Range"]
 
-# load dem shapefile
-dem = rxr.open_rasterio(dem_path, masked=True).squeeze() #todo: remove masked ...
-
 # loop over mountain ranges
 for name in name_list:
 
@@ -46,41 +49,39 @@ for name in name_list:
     xy_line, xy_box = get_swath_geometries(name)
 
     # create line
-    baseline = results_path + name + '/shapefiles/line.shp'
-    create_line_shp(xy_line, baseline)
-    line_shape = pyosp.read_shape(baseline)
+    line_shape = create_line(xy_line)
     lx, ly = line_shape.xy
 
-    # generate swath objects
+    # sample all rasters along the swath (coordinates are calculated once)
     w = 2 # 2 degrees + 2*cs
     ls = w/250
     cs = w/100
-    orig_dem = pyosp.Orig_curv(baseline, dem_path, width=w, line_stepsize=ls, cross_stepsize=cs)
-    orig_pr = pyosp.Orig_curv(baseline, pr_path, width=w, line_stepsize=ls, cross_stepsize=cs)
-    orig_pet = pyosp.Orig_curv(baseline, pet_path, width=w, line_stepsize=ls, cross_stepsize=cs)
-    orig_t = pyosp.Orig_curv(baseline, t_path, width=w, line_stepsize=ls, cross_stepsize=cs)
-    orig_pr2 = pyosp.Orig_curv(baseline, pr2_path, width=w, line_stepsize=ls, cross_stepsize=cs)
-    orig_pet2 = pyosp.Orig_curv(baseline, pet2_path, width=w, line_stepsize=ls, cross_stepsize=cs)
-    orig_t2 = pyosp.Orig_curv(baseline, t2_path, width=w, line_stepsize=ls, cross_stepsize=cs)
+    distance, swath_x, swath_y, swath_data = \
+        cached_sample_swath(line_shape, [dem_path, pr_path, pet_path, t_path, pr2_path, pet2_path, t2_path], w, ls, cs,
+                            results_path + name + "/cache/" if use_cache else None, cache_max_size, cache_max_age)
 
     ### PLOT 1 ###
     fig = plt.figure(figsize=(4, 2), constrained_layout=True)
     ax = plt.axes()
 
     # plot swath lines and polygons
-    swath_polylines = orig_dem.out_polylines()
-    #for line in swath_polylines:
+    polylines = swath_polylines(swath_x, swath_y)
+    #for line in polylines:
     #    x, y = line.xy
     #    ax.plot(x, y, color='tab:red')
 
-    swath_polygon = orig_dem.out_polygon()
-    px, py = swath_polygon.exterior.xy
+    polygon = swath_polygon(swath_x, swath_y)
+    px, py = polygon.exterior.xy
     ax.plot(px, py, c='tab:orange')
 
-    # save polygon as shapefile
-    create_polygon_shp(swath_polygon, results_path + name + '/shapefiles/polygon.shp')
+    # save line and polygon as shapefiles
+    if save_shapefiles:
+        create_lines_shp([line_shape], results_path + name + '/shapefiles/line.shp')
+        create_polygon_shp(polygon, results_path + name + '/shapefiles/polygon.shp')
 
-    sp0 = dem.plot.imshow(ax=ax, cmap='gray')
+    # only the region is read, at the resolution of the figure (see functions/background_map.py)
+    sp0 = plot_background(ax, dem_path, [xy_box[0], xy_box[1]], [xy_box[2], xy_box[3]],
+                          cache_dir=results_path + name + "/cache/" if use_cache else None, cmap='gray')
     ax.set(title=None) #"DEM [m]"
     #ax.set_axis_off()
     ax.axis('equal')
@@ -96,15 +97,18 @@ for name in name_list:
     plt.close()
 
     # plot swath profile
-    dist, dem_swath, pr_swath, pet_swath, t_swath = \
-        get_swath_data(orig_dem, orig_pr, orig_pet, orig_t, line_shape)
-    dist, dem_swath, pr2_swath, pet2_swath, t2_swath = \
-        get_swath_data(orig_dem, orig_pr2, orig_pet2, orig_t2, line_shape)
-
-    # account for offset and scale (only for CHELSA)
-    pr_swath = pr_swath * 0.1
-    pet_swath = pet_swath * 0.01 * 12
-    t_swath = t_swath * 0.1 - 273.15
+    dist, dem_swath, pr_swath, pet_swath, t_swath, pr2_swath, pet2_swath, t2_swath = \
+        get_swath_data(swath_data, distance, line_shape, position="km")
+    line_km = line_distance_km(line_shape, line_shape.length) # length of the swath along the line
+
+    # mask nodata of every product and account for offset and scale (only for CHELSA, see functions/products.py)
+    dem_swath = mask_and_scale(dem_swath, "Elevation_WorldClim")
+    pr_swath = mask_and_scale(pr_swath, "P_CHELSA")
+    pet_swath = mask_and_scale(pet_swath, "PET_CHELSA")
+    t_swath = mask_and_scale(t_swath, "T_CHELSA")
+    pr2_swath = mask_and_scale(pr2_swath, "P_WorldClim")
+    pet2_swath = mask_and_scale(pet2_swath, "PET_WorldClim")
+    t2_swath = mask_and_scale(t2_swath, "T_WorldClim")
 
     ### PLOT 2 ###
     # plot swath transect
@@ -119,8 +123,8 @@ for name in name_list:
     lines, labels = ax.get_legend_handles_labels()
     lim = 4000
     ax.set_ylim(0,lim)
-    ax.set_xlim([line_shape.xy[0][0], line_shape.xy[0][1]]) # works only for east-west swaths
-    ax.set_xlabel('Longitude [deg]')
+    ax.set_xlim([0, line_km])
+    ax.set_xlabel('Distance along swath [km]')
     ax.set_ylabel('[mm] / [m]')
 
     #plt.show()
@@ -140,8 +144,8 @@ for name in name_list:
     lines, labels = ax.get_legend_handles_labels()
     lim = 2500
     ax.set_ylim(0,lim)
-    ax.set_xlim([line_shape.xy[0][0], line_shape.xy[0][1]]) # works only for east-west swaths
-    ax.set_xlabel('Longitude [deg]')
+    ax.set_xlim([0, line_km])
+    ax.set_xlabel('Distance along swath [km]')
     ax.set_ylabel('[mm] / [m]')
 
     #plt.show()
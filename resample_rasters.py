@@ -1,7 +1,9 @@
-from osgeo import gdal
 import os
+from functions.resample import resample_rasters
+from functions.raster_stack import check_alignment
 
-# This script resamples and aligns different rasters.
+# This script resamples and aligns different rasters (in parallel, already resampled rasters whose
+# source and settings have not changed are skipped, see functions/resample.py).
 
 data_path = "/home/hydrosys/data/" #data_path = r"D:/Data/"
 results_path = "/home/hydrosys/data/resampling/"
@@ -9,6 +11,12 @@ results_path = "/home/hydrosys/data/resampling/"
 if not os.path.isdir(results_path):
     os.makedirs(results_path)
 
+manifest_path = results_path + "manifest.json" # checksums, settings, wall time, and peak memory of every output
+n_workers = 4 # number of parallel warps
+gdal_threads = 2 # GDAL threads per warp
+warp_memory_limit = 2048 # MB per warp
+gdal_cache_size = 512 # MB per warp
+
 bounds = [-180, -90, 180, 90]
 
 # 5 minute resolution
@@ -37,9 +45,23 @@ name_list = ["P_CHELSA",
 path_list = ["Global_Soil_Regolith_Sediment_1304/data/land_cover_mask.tif"]
 name_list = ["Pelletier"]
 
-for path, name in zip(path_list, name_list):
-    print(name)
-    ds_path = data_path + path
-    ds = gdal.Open(ds_path)
-    dsRes = gdal.Warp(results_path + name + "_30sec.tif", ds,
-                      outputBounds=bounds, xRes=res, yRes=res, resampleAlg="med", dstSRS="EPSG:4326")
+# output as Cloud-Optimized GeoTIFF with internal overviews (driver "GTiff" writes tiled GeoTIFFs without overviews)
+parameters = {"outputBounds": bounds, "xRes": res, "yRes": res, "resampleAlg": "med", "dstSRS": "EPSG:4326",
+              "driver": "COG", "block_size": 512, "compress": "DEFLATE", "predictor": None,
+              "overview_resampling": "AVERAGE"}
+class_layers = ["WorldLandform", "Pelletier"] # overviews of class layers keep the most frequent class
+sources = {name: (data_path + path, results_path + name + "_30sec.tif",
+                  {"overview_resampling": "MODE"} if name in class_layers else {})
+           for path, name in zip(path_list, name_list)}
+
+# every file is warped in a new worker process, which re-imports this script, so the warps are only
+# started from the main process
+if __name__ == "__main__":
+
+    manifest = resample_rasters(sources, parameters, manifest_path, n_workers, gdal_threads, warp_memory_limit,
+                                gdal_cache_size)
+
+    # check that all resampled rasters share one grid (so that they can be joined by array index), the
+    # outputs are only read (gdal.Warp writes the transform of outputBounds, xRes, and yRes exactly)
+    outputs = [entry["output"] for entry in manifest.values() if os.path.isfile(entry["output"])]
+    check_alignment(outputs, [os.path.basename(output) for output in outputs])